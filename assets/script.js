@@ -14,9 +14,12 @@ createApp({
         
         const isGenerating = ref(false); // 是否正在生成/接收流
         const isLoadingHistory = ref(false); // 是否正在加载历史
+        const searchQuery = ref(""); // 全文搜索关键词
+        const searchResults = ref([]); // 搜索结果
         
         let abortController = null; // 用于中断请求
         let aliveInterval = null; // 用于保活心跳
+        let searchTimer = null; // 搜索防抖
         
         // --- 辅助引用 ---
         const chatContainer = ref(null);
@@ -108,6 +111,44 @@ createApp({
             historyList.value = data; 
         };
 
+        // 订阅服务端推送的标题变化（其他标签页、托盘或后台生成的标题），按 id 幂等更新列表
+        let titleEvents = null;
+        const subscribeTitleEvents = () => {
+            titleEvents = new EventSource(`${API_BASE}/events`);
+            titleEvents.addEventListener('title', (e) => {
+                const event = JSON.parse(e.data);
+                const list = historyList.value;
+                const index = list.findIndex(h => h.id === event.id);
+                if (event.type === 'insert') {
+                    if (index !== -1) return;
+                    // 列表按 id 从大到小排列，只插入已加载范围内的对话
+                    const position = list.findIndex(h => h.id < event.id);
+                    if (position !== -1) list.splice(position, 0, { id: event.id, title: event.title });
+                    else if (list.length === 0) list.push({ id: event.id, title: event.title });
+                } else if (event.type === 'update') {
+                    if (index !== -1) list[index].title = event.title;
+                } else if (event.type === 'delete') {
+                    if (index !== -1) list.splice(index, 1);
+                }
+            });
+        };
+
+        // 全文搜索 (防抖 300ms)
+        const handleSearchInput = () => {
+            if (searchTimer) clearTimeout(searchTimer);
+            const query = searchQuery.value.trim();
+            if (!query) {
+                searchResults.value = [];
+                return;
+            }
+            searchTimer = setTimeout(async () => {
+                const res = await apiFetch(`/search?q=${encodeURIComponent(query)}`);
+                const data = await res.json();
+                // 输入已变化则丢弃过期结果
+                if (searchQuery.value.trim() === query) searchResults.value = data;
+            }, 300);
+        };
+
     // 切换对话前的保存与清理
         const saveCurrentChat = async () => {
             if (currentChatId.value) {
@@ -193,6 +234,7 @@ createApp({
 
         // 无限滚动逻辑 (Pagination)
         const handleHistoryScroll = async (e) => {
+            if (searchQuery.value.trim()) return; // 搜索结果不分页
             const { scrollTop, scrollHeight, clientHeight } = e.target;
             
             // 触底加载更早的 (below)
@@ -212,12 +254,7 @@ createApp({
                 }
             }
 
-            // 触顶加载更新的 (above) - 视需求，一般新对话会自动插在最前
-            if (scrollTop < 10 && historyList.value.length > 0) {
-                const firstId = historyList.value[0].id;
-                // 这里可以实现检查有没有新产生的对话（比如在其他设备产生的）
-                // const res = await apiFetch(`/get?above=${firstId}`);
-            }
+            // 其他地方新产生的对话由 /events 推送插入到最前，触顶时无需再查询 above
         };
 
         // --- 核心：发送与流式接收 ---
@@ -310,8 +347,10 @@ createApp({
                                 if (data.id && !currentChatId.value) {
                                     currentChatId.value = data.id;
                                     startAliveLoop(data.id);
-                                    // 临时添加到历史列表顶部，直到有标题
-                                    historyList.value.unshift({ id: data.id, title: "新对话" });
+                                    // 临时添加到历史列表顶部，直到有标题（/events 可能已先推送）
+                                    if (!historyList.value.some(h => h.id === data.id)) {
+                                        historyList.value.unshift({ id: data.id, title: "新对话" });
+                                    }
                                 }
 
                                 // 处理 Title
@@ -343,6 +382,17 @@ createApp({
                                     }
                                 }
 
+                                // 处理服务端的生成错误，回答不完整
+                                if (data.error) {
+                                    const activeMsg = messages.value[messages.value.length - 1];
+                                    if (activeMsg.role === 'assistant') {
+                                        activeMsg.text += `\n[出错: ${data.error}]`;
+                                    } else {
+                                        messages.value.push({ role: 'assistant', text: `[出错: ${data.error}]` });
+                                    }
+                                    scrollToBottom();
+                                }
+
                                 // 处理 Data 内容
                                 if (data.data) {
                                     const activeMsg = messages.value[messages.value.length - 1];
@@ -409,6 +459,7 @@ createApp({
         // --- 生命周期 ---
         onMounted(() => {
             loadHistoryList();
+            subscribeTitleEvents();
             
             window.addEventListener('visibilitychange', () => {
                 if (document.visibilityState === 'hidden' && currentChatId.value) {
@@ -420,6 +471,7 @@ createApp({
 
         onBeforeUnmount(() => {
             if (aliveInterval) clearInterval(aliveInterval);
+            if (titleEvents) titleEvents.close();
         });
 
         return {
@@ -431,6 +483,9 @@ createApp({
             inputImages,
             isGenerating,
             isLoadingHistory,
+            searchQuery,
+            searchResults,
+            handleSearchInput,
             currentChatId,
             chatContainer,
             inputBox,
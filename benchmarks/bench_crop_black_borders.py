@@ -0,0 +1,108 @@
+"""crop_black_borders 基准测试：逐像素扫描旧实现 vs getbbox 新实现
+
+在项目根目录运行: python benchmarks/bench_crop_black_borders.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from individual_modules import crop_black_borders
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+    "8K": (7680, 4320),
+}
+BORDERS = [0, 8, 64, 256]
+
+
+def legacy_crop_black_borders(image):
+    """改动前的逐像素实现，仅用于对比结果与耗时"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    width, height = image.size
+    if width == 0 or height == 0:
+        return image
+    pixels = image.load()
+    top = 0
+    for y in range(height):
+        for x in range(width):
+            if pixels[x, y] != (0, 0, 0):
+                top = y
+                break
+        else:
+            continue
+        break
+    bottom = height - 1
+    for y in range(height - 1, -1, -1):
+        for x in range(width):
+            if pixels[x, y] != (0, 0, 0):
+                bottom = y
+                break
+        else:
+            continue
+        break
+    left = 0
+    for x in range(width):
+        for y in range(height):
+            if pixels[x, y] != (0, 0, 0):
+                left = x
+                break
+        else:
+            continue
+        break
+    right = width - 1
+    for x in range(width - 1, -1, -1):
+        for y in range(height):
+            if pixels[x, y] != (0, 0, 0):
+                right = x
+                break
+        else:
+            continue
+        break
+    if left >= right or top >= bottom:
+        return image
+    return image.crop((left, top, right + 1, bottom + 1))
+
+
+def make_image(size, border):
+    """生成带黑边的合成截图，内容区域为浅色"""
+    width, height = size
+    image = Image.new('RGB', size, (0, 0, 0))
+    if border * 2 < width and border * 2 < height:
+        image.paste((240, 240, 240), (border, border, width - border, height - border))
+    return image
+
+
+def timeit(func, image, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(image)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    # 旧实现在 8K 大黑边下非常慢，默认跳过，传入 --legacy-all 强制运行
+    legacy_all = "--legacy-all" in sys.argv
+    print(f"{'分辨率':<8}{'边框':>6}{'旧实现(ms)':>14}{'新实现(ms)':>14}{'加速比':>10}")
+    for name, size in RESOLUTIONS.items():
+        for border in BORDERS:
+            image = make_image(size, border)
+            new_time, new_result = timeit(crop_black_borders, image, 5)
+            if name == "8K" and border >= 64 and not legacy_all:
+                print(f"{name:<8}{border:>6}{'跳过':>14}{new_time * 1000:>14.2f}{'-':>10}")
+                continue
+            old_time, old_result = timeit(legacy_crop_black_borders, image, 1)
+            assert old_result.size == new_result.size and old_result.tobytes() == new_result.tobytes(), f"{name} border={border} 裁剪结果不一致"
+            print(f"{name:<8}{border:>6}{old_time * 1000:>14.2f}{new_time * 1000:>14.2f}{old_time / new_time:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""网页首屏基准测试：测量首次内容绘制 (FCP) 时间与传输字节数
+
+先启动网页模式（托盘中开启，或 python -c "from server import _run_server; _run_server('deepseek-chat', 'qwen3-vl-plus', 'qwen-flash')"），
+分别在运行 build_assets.py 前后执行，对比 CDN 版与本地预压缩版：
+
+    python benchmarks/bench_first_paint.py [页面地址 ...] [--offline]
+
+--offline 时拦截所有非本机请求，模拟无外网的局域网机器。
+需要 playwright（pip install playwright && playwright install chromium）。
+"""
+import statistics
+import sys
+from urllib.parse import urlsplit
+
+from playwright.sync_api import sync_playwright
+
+RUNS = 5
+TIMEOUT_MS = 30000
+
+METRICS_JS = """() => {
+    const paint = performance.getEntriesByName('first-contentful-paint')[0];
+    const resources = performance.getEntriesByType('resource');
+    const navigation = performance.getEntriesByType('navigation')[0];
+    return {
+        fcp: paint ? paint.startTime : null,
+        load: navigation.loadEventEnd,
+        transferred: resources.reduce((sum, r) => sum + r.transferSize, 0) + navigation.transferSize,
+        decoded: resources.reduce((sum, r) => sum + r.decodedBodySize, 0) + navigation.decodedBodySize,
+        requests: resources.length + 1,
+        external: resources.filter(r => new URL(r.name).hostname !== location.hostname).length,
+    };
+}"""
+
+
+def measure(browser, url, offline, warm):
+    context = browser.new_context()
+    if offline:
+        host = urlsplit(url).hostname
+        context.route("**/*", lambda route: route.continue_() if urlsplit(route.request.url).hostname == host else route.abort())
+    page = context.new_page()
+    page.goto(url, wait_until="load", timeout=TIMEOUT_MS)
+    if warm: # 第二次加载，命中浏览器缓存
+        page.reload(wait_until="load", timeout=TIMEOUT_MS)
+    page.wait_for_timeout(200)
+    metrics = page.evaluate(METRICS_JS)
+    context.close()
+    return metrics
+
+
+def main():
+    offline = "--offline" in sys.argv
+    urls = [arg for arg in sys.argv[1:] if not arg.startswith("--")] or ["http://127.0.0.1:3417/"]
+    print(f"{'地址':<28}{'加载':<6}{'FCP(ms)':>10}{'load(ms)':>10}{'传输(KB)':>10}{'解码(KB)':>10}{'请求':>6}{'外部':>6}")
+    with sync_playwright() as playwright:
+        browser = playwright.chromium.launch()
+        for url in urls:
+            for warm in (False, True):
+                results = [measure(browser, url, offline, warm) for _ in range(RUNS)]
+                fcp = [r["fcp"] for r in results if r["fcp"] is not None]
+                median = lambda key: statistics.median(r[key] for r in results)
+                print(f"{url:<28}{'热' if warm else '冷':<6}{statistics.median(fcp) if fcp else float('nan'):>10.0f}{median('load'):>10.0f}"
+                      f"{median('transferred') / 1024:>10.1f}{median('decoded') / 1024:>10.1f}{median('requests'):>6.0f}{median('external'):>6.0f}")
+        browser.close()
+
+
+if __name__ == "__main__":
+    main()
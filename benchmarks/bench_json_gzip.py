@@ -0,0 +1,86 @@
+"""大型 JSON 响应压缩基准测试：不压缩 vs 流式 gzip
+
+生成几种典型的历史记录（纯文本长对话、内联 base64 截图的旧格式对话、只含 blob 引用的新格式对话、标题列表），
+统计发送字节数、压缩耗时、首个分块的产出时间，并按几种局域网带宽估算传输完成时间
+（流式压缩与发送重叠，估算为 max(压缩耗时, 传输耗时) + 首块耗时）。
+
+在项目根目录运行: python benchmarks/bench_json_gzip.py
+"""
+import base64
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from individual_modules import iter_gzip, should_gzip_json
+
+BANDWIDTHS = {"1Gbps": 125_000_000, "100Mbps": 12_500_000, "10Mbps": 1_250_000}
+
+
+def _text(rng, length):
+    words = ["这个", "问题", "可以", "通过", "以下", "方法", "解决", "代码", "函数", "返回", "the", "value", "of", "def", "return", "\n"]
+    return "".join(rng.choice(words) for _ in range(length // 2))
+
+
+def make_history(turns, images_per_turn=0, image_bytes=150_000, blob_refs=False, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for turn in range(turns):
+        content = []
+        for i in range(images_per_turn):
+            if blob_refs:
+                url = f"/blob/{rng.getrandbits(256):064x}.jpg"
+            else:
+                # JPEG 数据近似随机，base64 后只能压缩到约 3/4
+                url = "data:image/jpeg;base64," + base64.b64encode(rng.randbytes(image_bytes)).decode()
+            content.append({"type": "image_url", "image_url": {"url": url}})
+        content.append({"type": "text", "text": _text(rng, 200)})
+        messages.append({"role": "user", "content": content})
+        messages.append({"role": "assistant", "content": _text(rng, 1500)})
+    return messages
+
+
+def make_titles(count=20):
+    return [{"id": i, "title": f"对话标题 {i}"} for i in range(count)]
+
+
+CASES = {
+    "标题列表": make_titles(),
+    "纯文本 100 轮": make_history(100),
+    "blob 引用 50 轮": make_history(50, images_per_turn=2, blob_refs=True),
+    "内联截图 20 轮": make_history(20, images_per_turn=2),
+    "内联截图 100 轮": make_history(100, images_per_turn=2),
+}
+
+
+def main():
+    print(f"{'场景':<16}{'原始(KB)':>12}{'发送(KB)':>12}{'压缩比':>8}{'压缩(ms)':>10}{'首块(ms)':>10}" + "".join(f"{name + '(ms)':>18}" for name in BANDWIDTHS))
+    for name, value in CASES.items():
+        body = json.dumps(value, ensure_ascii=False)
+        raw = len(body.encode('utf-8'))
+        if should_gzip_json(body, "gzip, deflate, br"):
+            start = time.perf_counter()
+            first = None
+            sent = 0
+            for chunk in iter_gzip(body):
+                if first is None:
+                    first = time.perf_counter() - start
+                sent += len(chunk)
+            compress_time = time.perf_counter() - start
+        else:
+            sent, compress_time, first = raw, 0.0, 0.0
+        cells = ""
+        for bandwidth in BANDWIDTHS.values():
+            plain = raw / bandwidth
+            gz = first + max(compress_time - first, sent / bandwidth)
+            cells += f"{plain * 1000:>8.0f} → {gz * 1000:<7.0f}"
+        print(f"{name:<16}{raw / 1024:>12.1f}{sent / 1024:>12.1f}{raw / sent:>8.2f}{compress_time * 1000:>10.1f}{first * 1000:>10.1f}{cells}")
+    print("带宽列为 不压缩 → 流式 gzip 的估算完成时间")
+
+
+if __name__ == "__main__":
+    main()
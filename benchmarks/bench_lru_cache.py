@@ -0,0 +1,137 @@
+"""LRUCache 基准测试：改动前的纯条目数版本 vs 带内存预算与统计的版本
+
+分别测试 get/put 吞吐量（含 allow_reverse 模式），以及按内存预算淘汰时的命中率与淘汰次数。
+
+在项目根目录运行: python benchmarks/bench_lru_cache.py [操作次数]
+"""
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lru_cache import LRUCache, estimate_size
+
+CAPACITY = 50
+KEY_SPACE = 80  # 访问的键的范围，略大于容量以产生淘汰
+
+
+class LegacyLRUCache:
+    """改动前的实现，仅用于对比"""
+    def __init__(self, capacity=50, allow_reverse=False):
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        self.allow_reverse = allow_reverse
+        # 只有开启反向查询时才初始化字典，节省空间
+        self.rev_cache = {} if allow_reverse else None
+    
+    def get(self, key):
+        if key not in self.cache:
+            return None
+        
+        # 移动到最新位置 (MRU)
+        self.cache.move_to_end(key)
+        val = self.cache[key]
+        
+        # 如果支持反向查询，既然这个key刚被访问过，它就是这个值对应的“最新”键
+        if self.allow_reverse:
+            self.rev_cache[val] = key
+            
+        return val
+    
+    def put(self, key, value):
+        if key in self.cache:
+            # key 已存在：移动到最新位置
+            self.cache.move_to_end(key)
+            
+            # 处理反向索引更新
+            if self.allow_reverse:
+                old_val = self.cache[key]
+                # 如果值发生了变化，且旧值的反向索引指向当前key，则删除旧索引
+                if old_val != value and self.rev_cache.get(old_val) == key:
+                    del self.rev_cache[old_val]
+        else:
+            # key 不存在：检查容量
+            if len(self.cache) >= self.capacity:
+                # 弹出最旧项 (FIFO)
+                old_k, old_v = self.cache.popitem(last=False)
+                
+                # 如果被删除的键是其值的反向索引代表，则清理反向索引
+                # 注意：如果 rev_cache[old_v] 指向的是别的（更新的）key，则不删除
+                if self.allow_reverse and self.rev_cache.get(old_v) == old_k:
+                    del self.rev_cache[old_v]
+        
+        # 更新主缓存
+        self.cache[key] = value
+        
+        # 更新反向索引：无论 value 是否重复，当前 key 都是该 value 的“最新”代表
+        if self.allow_reverse:
+            self.rev_cache[value] = key
+            
+    def find_key(self, value):
+        """
+        通过值反向查询键。
+        如果多个键对应同一个值，返回最新的（最后被 put 或 get 的）那个键。
+        """
+        if not self.allow_reverse:
+            return None
+        return self.rev_cache.get(value)
+
+
+def make_workload(count, seed=0):
+    """80% 读 20% 写，键按幂律分布，模拟少数对话被反复打开"""
+    rng = random.Random(seed)
+    return [(rng.random() < 0.2, int(KEY_SPACE * rng.random() ** 2)) for _ in range(count)]
+
+
+def run(cache, workload, value_of):
+    start = time.perf_counter()
+    for is_put, key in workload:
+        if is_put:
+            cache.put(key, value_of(key))
+        else:
+            cache.get(key)
+    return time.perf_counter() - start
+
+
+def fake_history(key):
+    """带若干张截图 (base64) 的对话，大小随 key 变化"""
+    image = "A" * (200_000 + key * 10_000)
+    return [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": image}}, {"type": "text", "text": "你好" * 50}]}, {"role": "assistant", "content": "好的" * 200}]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    workload = make_workload(count)
+    print(f"{count} 次操作，容量 {CAPACITY}")
+    print(f"{'实现':<28}{'耗时(ms)':>12}{'ops/s':>14}")
+    cases = [
+        ("旧版", lambda: LegacyLRUCache(CAPACITY), str),
+        ("旧版 allow_reverse", lambda: LegacyLRUCache(CAPACITY, allow_reverse=True), str),
+        ("新版", lambda: LRUCache(CAPACITY), str),
+        ("新版 allow_reverse", lambda: LRUCache(CAPACITY, allow_reverse=True), str),
+        ("新版 sizer=len", lambda: LRUCache(CAPACITY, max_bytes=10 ** 9, sizer=len), str),
+        ("新版 allow_reverse sizer=len", lambda: LRUCache(CAPACITY, allow_reverse=True, max_bytes=10 ** 9, sizer=len), str),
+    ]
+    for name, make_cache, value_of in cases:
+        elapsed = run(make_cache(), workload, value_of)
+        print(f"{name:<28}{elapsed * 1000:>12.0f}{count / elapsed:>14.0f}")
+
+    # 内存预算：对话大小约 0.2~1MB，预算 16MB 时条目数由预算而非容量决定
+    histories = {key: fake_history(key) for key in range(KEY_SPACE)}
+    small = make_workload(20_000, seed=1)
+    print()
+    print(f"{'预算':<12}{'条目':>8}{'占用(MB)':>12}{'命中率':>10}{'淘汰次数':>10}")
+    for budget in (None, 64 * 1024 * 1024, 16 * 1024 * 1024):
+        cache = LRUCache(CAPACITY, max_bytes=budget, sizer=estimate_size)
+        run(cache, small, histories.__getitem__)
+        stats = cache.stats()
+        label = "不限" if budget is None else f"{budget // 1048576}MB"
+        print(f"{label:<12}{stats['entries']:>8}{stats['bytes'] / 1048576:>12.1f}{stats['hit_rate']:>10.1%}{stats['evictions']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""网页模式基准测试：线程版 server.py vs asyncio 版 server_async.py
+
+启动一个本地的假 OpenAI 兼容 SSE 服务，分别以两种模式启动网页后端，
+并发发起 /generate 流式请求，统计首字节延迟与完成时间。
+
+在项目根目录运行: python benchmarks/bench_server_modes.py [并发数 ...]
+需要 httpx（openai 的依赖，一般已随之安装；否则 pip install httpx）。
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_PORT = 18417
+SERVER_PORT = 13417
+CHUNKS = 40  # 每次回答的分片数
+CHUNK_INTERVAL = 0.05  # 分片间隔（秒），模拟模型输出速度
+TITLE_DELAY = 0.0  # 非流式请求（标题生成）的耗时（秒）
+
+MODES = {
+    "threaded": "from server import _run_server as run",
+    "async": "from server_async import _run_async_server as run",
+}
+
+
+async def _fake_openai_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """极简的 OpenAI 兼容接口：stream=True 时按固定节奏输出 SSE，否则直接返回标题"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+        length = 0
+        for line in head.decode().split("\r\n"):
+            if line.lower().startswith("content-length:"):
+                length = int(line.split(":", 1)[1])
+        body = json.loads(await reader.readexactly(length))
+        if body.get("stream"):
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+            for i in range(CHUNKS):
+                chunk = {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                         "choices": [{"index": 0, "delta": {"content": f"token{i} "}, "finish_reason": None}]}
+                writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await writer.drain()
+                await asyncio.sleep(CHUNK_INTERVAL)
+            writer.write(b"data: [DONE]\n\n")
+        else:
+            await asyncio.sleep(TITLE_DELAY)
+            payload = json.dumps({"id": "fake", "object": "chat.completion", "created": 0, "model": body["model"],
+                                  "choices": [{"index": 0, "message": {"role": "assistant", "content": "基准测试"}, "finish_reason": "stop"}]}).encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                         + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+        await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def _prepare_workdir() -> str:
+    workdir = tempfile.mkdtemp(prefix="jankytray-bench-")
+    os.makedirs(f"{workdir}/saves/histories")
+    fake = {"url": f"http://127.0.0.1:{FAKE_PORT}/v1", "api_key": "fake"}
+    with open(f"{workdir}/saves/models.json", "w", encoding="utf-8") as f:
+        json.dump({"fake-chat": fake, "fake-title": fake}, f)
+    conn = sqlite3.connect(f"{workdir}/saves/history_titles.db")
+    conn.execute("CREATE TABLE titles (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT)")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.commit()
+    conn.close()
+    return workdir
+
+
+async def _wait_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"端口 {port} 未就绪")
+
+
+async def _one_stream(client: httpx.AsyncClient):
+    start = time.perf_counter()
+    first_byte = None
+    async with client.stream("POST", f"http://127.0.0.1:{SERVER_PORT}/generate", json={"content": [{"type": "text", "text": "你好"}]}) as response:
+        async for _ in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+    return first_byte, time.perf_counter() - start
+
+
+def _percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _run_mode(mode: str, workdir: str, concurrencies: list[int]):
+    code = f"import sys; sys.path.insert(0, {REPO_DIR!r}); {MODES[mode]}; run('fake-chat', 'fake-chat', 'fake-title', port={SERVER_PORT})"
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await _wait_port(SERVER_PORT)
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+            for concurrency in concurrencies:
+                start = time.perf_counter()
+                results = await asyncio.gather(*[_one_stream(client) for _ in range(concurrency)], return_exceptions=True)
+                wall = time.perf_counter() - start
+                ok = [r for r in results if not isinstance(r, BaseException)]
+                if not ok:
+                    print(f"{mode:<10}{concurrency:>8}{0:>8}{'-':>12}{'-':>12}{'-':>12}{wall:>10.2f}")
+                    continue
+                ttfb = [r[0] for r in ok if r[0] is not None]
+                total = [r[1] for r in ok]
+                print(f"{mode:<10}{concurrency:>8}{len(ok):>8}{_percentile(ttfb, 0.5) * 1000:>12.1f}{_percentile(ttfb, 0.95) * 1000:>12.1f}{_percentile(total, 0.5):>12.2f}{wall:>10.2f}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def main():
+    concurrencies = [int(i) for i in sys.argv[1:]] or [10, 100, 300]
+    workdir = _prepare_workdir()
+    fake_server = await asyncio.start_server(_fake_openai_handler, "127.0.0.1", FAKE_PORT, backlog=4096)
+    ideal = CHUNKS * CHUNK_INTERVAL
+    print(f"假模型单次回答理论耗时 {ideal:.2f}s，工作目录 {workdir}")
+    print(f"{'模式':<10}{'并发':>8}{'成功':>8}{'TTFB p50':>12}{'TTFB p95':>12}{'完成 p50':>12}{'总耗时':>10}")
+    async with fake_server:
+        for mode in MODES:
+            await _run_mode(mode, workdir, concurrencies)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
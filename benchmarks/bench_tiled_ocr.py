@@ -0,0 +1,143 @@
+"""分块 OCR 基准测试：整图一次识别 vs 分块并发识别
+
+启动一个本地的假 Azure Computer Vision 接口：按上传字节数模拟网络耗时，
+超过服务限制的图片返回错误，并从合成截图中“识别”出色块对应的文字行。
+对比两种方式的耗时，并检查分块合并后的行与整图识别完全一致（无遗漏、无重复、顺序相同）。
+
+在项目根目录运行: python benchmarks/bench_tiled_ocr.py
+"""
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+import individual_modules
+from individual_modules import models, http_client, ocr_image_azure
+
+STUB_PORT = 18418
+BASE_LATENCY = 0.15  # 单次请求的固定耗时（秒）
+UPLOAD_BYTES_PER_SECOND = 4 * 1024 * 1024  # 模拟上传带宽
+MAX_SIDE = 10000  # 模拟服务端对图片边长的限制
+
+LINE_WIDTH = 600
+LINE_HEIGHT = 20
+LINE_SPACING = 40
+CASES = {
+    "1080p": (1920, 1080),
+    "4K": (3840, 2160),
+    "长截图": (1920, 16000),
+    "8K": (7680, 4320),
+}
+
+
+def make_image(size):
+    """白底合成截图，每个色块代表一行文字，颜色编码行号"""
+    width, height = size
+    image = Image.new('RGB', size, (255, 255, 255))
+    line_id = 1
+    for y in range(10, height - LINE_HEIGHT, LINE_SPACING):
+        for x in range(40, width - LINE_WIDTH, LINE_WIDTH + 60):
+            image.paste((line_id % 200, line_id // 200 % 200, 0), (x, y, x + LINE_WIDTH, y + LINE_HEIGHT))
+            line_id += 1
+    return image
+
+
+def _segments(profile: bytes):
+    """灰度投影中连续的非白色区间"""
+    segments = []
+    start = None
+    for i, value in enumerate(profile):
+        if value < 250 and start is None:
+            start = i
+        elif value >= 250 and start is not None:
+            segments.append((start, i))
+            start = None
+    if start is not None:
+        segments.append((start, len(profile)))
+    return segments
+
+
+def fake_read(image):
+    width, height = image.size
+    gray = image.convert('L')
+    lines = []
+    for top, bottom in _segments(gray.resize((1, height), Image.Resampling.BOX).tobytes()):
+        band = gray.crop((0, top, width, bottom))
+        for left, right in _segments(band.resize((width, 1), Image.Resampling.BOX).tobytes()):
+            r, g, _ = image.getpixel(((left + right) // 2, (top + bottom) // 2))
+            lines.append({
+                "text": f"第{g * 200 + r}行",
+                "boundingPolygon": [{"x": left, "y": top}, {"x": right, "y": top}, {"x": right, "y": bottom}, {"x": left, "y": bottom}],
+            })
+    return {"readResult": {"blocks": [{"lines": lines}]}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(BASE_LATENCY + len(body) / UPLOAD_BYTES_PER_SECOND)
+        image = Image.open(BytesIO(body)).convert('RGB')
+        if max(image.size) > MAX_SIDE:
+            data = {"error": {"message": f"图片尺寸 {image.size} 超出限制"}}
+        else:
+            data = fake_read(image)
+        payload = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(ocr, image, tile_size):
+    models["azure-computer-vision"]["tile_size"] = tile_size
+    start = time.perf_counter()
+    try:
+        text = ocr(image)
+    except Exception as e:
+        return time.perf_counter() - start, None, str(e)
+    return time.perf_counter() - start, text, None
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", STUB_PORT), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    models["azure-computer-vision"] = {"url": f"http://127.0.0.1:{STUB_PORT}/", "Ocp-Apim-Subscription-Key": "stub"}
+    http_client.log = False
+    # 绕过感知哈希缓存与磁盘缓存，每次都真正请求
+    ocr = inspect.unwrap(ocr_image_azure)
+
+    print(f"{'场景':<8}{'尺寸':>14}{'行数':>8}{'整图(ms)':>12}{'分块(ms)':>12}{'加速比':>8}  结果")
+    for name, size in CASES.items():
+        image = make_image(size)
+        whole_time, whole_text, whole_error = run(ocr, image, 10 ** 9)
+        tiled_time, tiled_text, tiled_error = run(ocr, image, individual_modules.OCR_TILE_SIZE)
+        assert tiled_error is None, tiled_error
+        expected = [f"第{i}行" for i in range(1, tiled_text.count("\n") + 1)]
+        assert tiled_text.splitlines() == expected, f"{name} 分块合并结果有遗漏、重复或乱序"
+        if whole_error:
+            result = f"整图失败: {whole_error}"
+            whole_cell = "失败"
+            speedup = "-"
+        else:
+            assert whole_text == tiled_text, f"{name} 分块结果与整图不一致"
+            result = "一致"
+            whole_cell = f"{whole_time * 1000:.0f}"
+            speedup = f"{whole_time / tiled_time:.1f}"
+        print(f"{name:<8}{f'{size[0]}x{size[1]}':>14}{len(expected):>8}{whole_cell:>12}{tiled_time * 1000:>12.0f}{speedup:>8}  {result}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""新对话的回答流完成时间与标题送达时间
+
+假模型的标题请求比回答慢（TITLE_DELAY），分别以两种模式启动网页后端，同时订阅 /events，
+对每个新对话记录：回答流关闭的时间、标题通过回答流送达的时间（若有）、标题通过 /events 送达的时间。
+改动前回答流要等标题生成完才关闭，完成时间约为 max(回答, 标题)。
+
+在项目根目录运行: python benchmarks/bench_title_latency.py [标题耗时秒数] [对话数]
+需要 httpx（openai 的依赖，一般已随之安装；否则 pip install httpx）。
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_server_modes as base
+
+
+async def _watch_events(client: httpx.AsyncClient, arrivals: dict, ready: asyncio.Event):
+    async with client.stream("GET", f"http://127.0.0.1:{base.SERVER_PORT}/events") as response:
+        ready.set()
+        event_name = None
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                event_name = line[6:].strip()
+            elif line.startswith("data:") and event_name == "title":
+                event = json.loads(line[5:])
+                if event["type"] == "update":
+                    arrivals[event["id"]] = time.perf_counter()
+
+
+async def _one_chat(client: httpx.AsyncClient):
+    start = time.perf_counter()
+    chat_id = None
+    title_in_stream = None
+    async with client.stream("POST", f"http://127.0.0.1:{base.SERVER_PORT}/generate", json={"content": [{"type": "text", "text": "你好"}]}) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = json.loads(line[5:])
+            if "id" in data and chat_id is None:
+                chat_id = data["id"]
+            if "title" in data:
+                title_in_stream = time.perf_counter() - start
+    return chat_id, start, time.perf_counter() - start, title_in_stream
+
+
+async def _run_mode(mode: str, workdir: str, chats: int):
+    code = f"import sys; sys.path.insert(0, {base.REPO_DIR!r}); {base.MODES[mode]}; run('fake-chat', 'fake-chat', 'fake-title', port={base.SERVER_PORT})"
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await base._wait_port(base.SERVER_PORT)
+        async with httpx.AsyncClient(timeout=None) as client:
+            arrivals = {}
+            ready = asyncio.Event()
+            watcher = asyncio.create_task(_watch_events(client, arrivals, ready))
+            await ready.wait()
+            results = await asyncio.gather(*[_one_chat(client) for _ in range(chats)])
+            await asyncio.sleep(base.TITLE_DELAY + 1)
+            watcher.cancel()
+        done = [r[2] for r in results]
+        in_stream = [r[3] for r in results if r[3] is not None]
+        via_events = [arrivals[r[0]] - r[1] for r in results if r[0] in arrivals]
+        fmt = lambda values: f"{sum(values) / len(values):.2f}" if values else "-"
+        print(f"{mode:<10}{chats:>6}{fmt(done):>14}{len(in_stream):>12}{fmt(via_events):>16}{len(via_events):>10}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def main():
+    base.TITLE_DELAY = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    workdir = base._prepare_workdir()
+    fake_server = await asyncio.start_server(base._fake_openai_handler, "127.0.0.1", base.FAKE_PORT, backlog=4096)
+    print(f"回答理论耗时 {base.CHUNKS * base.CHUNK_INTERVAL:.2f}s，标题耗时 {base.TITLE_DELAY:.2f}s")
+    print(f"{'模式':<10}{'对话':>6}{'回答完成(s)':>14}{'流内标题':>12}{'/events 标题(s)':>16}{'送达数':>10}")
+    async with fake_server:
+        for mode in base.MODES:
+            await _run_mode(mode, workdir, chats)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
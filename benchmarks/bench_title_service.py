@@ -0,0 +1,115 @@
+"""标题生成基准测试：每个新对话一个线程直接请求 vs TitleService（去重 + 记忆化，可选合并请求）
+
+启动一个本地的假 OpenAI 兼容接口：每次请求固定耗时，合并请求按条数略增耗时，
+并统计上游请求数与最大并发。模拟一批新对话同时到来，其中开场白有大量重复。
+
+在项目根目录运行: python benchmarks/bench_title_service.py [对话数] [不同开场白数]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import individual_modules
+from individual_modules import models, ask_ai, DiskCache, TitleService, TITLE_SYSTEM_PROMPT, TITLE_BATCH_SYSTEM_PROMPT
+
+STUB_PORT = 18419
+BASE_LATENCY = 0.4  # 单次请求的固定耗时（秒）
+PER_ITEM_LATENCY = 0.03  # 合并请求中每多一条的额外耗时
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+    requests = 0
+    active = 0
+    max_active = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = StubHandler
+        with cls.lock:
+            cls.requests += 1
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        system, user = body["messages"][0]["content"], body["messages"][1]["content"]
+        if system == TITLE_BATCH_SYSTEM_PROMPT:
+            texts = json.loads(user)
+            time.sleep(BASE_LATENCY + PER_ITEM_LATENCY * len(texts))
+            content = json.dumps([f"关于{text[:8]}" for text in texts], ensure_ascii=False)
+        else:
+            time.sleep(BASE_LATENCY)
+            content = f"关于{' '.join(user.split())[:8]}"
+        with cls.lock:
+            cls.active -= 1
+        payload = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def legacy(prompts, model):
+    """改动前：每个新对话一个线程，直接请求"""
+    results = [None] * len(prompts)
+    def worker(i):
+        results[i] = ask_ai(TITLE_SYSTEM_PROMPT, prompts[i], model=model, prefix="```标题\n", stop="\n```")
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(prompts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def with_service(prompts, model):
+    service = TitleService(log=False)
+    return [future.result() for future in [service.submit(prompt, model) for prompt in prompts]]
+
+
+def run(name, func, prompts, model, workdir):
+    individual_modules.extractor_cache = DiskCache(f"{workdir}/{name}.db", log=False) # 每种方式从空缓存开始
+    StubHandler.requests = StubHandler.max_active = 0
+    start = time.perf_counter()
+    titles = func(prompts, model)
+    elapsed = time.perf_counter() - start
+    individual_modules.extractor_cache.conn.close()
+    assert all(title for title in titles), f"{name} 有对话没有得到标题"
+    print(f"{name:<16}{elapsed * 1000:>10.0f}{StubHandler.requests:>10}{StubHandler.max_active:>10}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    server = ThreadingHTTPServer(("127.0.0.1", STUB_PORT), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    rng = random.Random(0)
+    openers = [f"帮我看看这段代码 {i} 为什么报错" for i in range(distinct)]
+    # 相同开场白在空白上有差异，规范化后应视为同一输入
+    prompts = [rng.choice(openers).replace(" ", rng.choice([" ", "  ", "\n"])) for _ in range(count)]
+    models["bench-title"] = {"url": f"http://127.0.0.1:{STUB_PORT}/", "api_key": "stub"}
+    models["bench-title-batch"] = {"url": f"http://127.0.0.1:{STUB_PORT}/", "api_key": "stub", "title_batch": True}
+    print(f"{count} 个新对话，{distinct} 种开场白")
+    print(f"{'方式':<16}{'耗时(ms)':>10}{'上游请求':>10}{'最大并发':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        run("每对话一线程", legacy, prompts, "bench-title", workdir)
+        run("TitleService", with_service, prompts, "bench-title", workdir)
+        run("TitleService合并", with_service, prompts, "bench-title-batch", workdir)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""托盘窗口流式渲染基准测试：每个片段单独插入 vs TokenRenderer 按帧合并插入
+
+用一个假的 token 流（前半段为思考内容，带 thinking 标签）在后台线程中写入文本框，
+统计全部渲染完成的耗时、insert 调用次数，以及 Tk 主循环的最大卡顿（10ms 心跳的最大间隔），
+并检查最终文本与标签范围与预期一致。
+
+在项目根目录运行: python benchmarks/bench_token_rendering.py [token 数] [每秒 token 数，0 为不限速]
+传入 --legacy-direct 额外测试改动前的做法（在生成线程中直接调用 insert，可能卡死 Tk）。
+"""
+import os
+import random
+import sys
+import threading
+import time
+import tkinter as tk
+from tkinter import scrolledtext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from individual_modules import TokenRenderer
+
+HEARTBEAT_MS = 10
+
+
+def fake_tokens(count: int, seed: int = 0) -> list[tuple[str, str | None]]:
+    rng = random.Random(seed)
+    alphabet = "的一是在不了有和人这中大为上个国我以要他abcdefghij "
+    tokens = []
+    for i in range(count):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3)))
+        tokens.append((text, "thinking" if i < count // 2 else None))
+    return tokens
+
+
+class PerTokenWriter:
+    """每个片段通过 after(0) 在 Tk 线程中单独插入一次"""
+    def __init__(self, widget):
+        self.widget = widget
+        self.frames = 0
+
+    def write(self, text, tag=None):
+        self.widget.after(0, self._insert, text, tag)
+
+    def _insert(self, text, tag):
+        self.widget.insert(tk.END, text, tag or ())
+        self.frames += 1
+
+    def flush(self):
+        pass
+
+
+class DirectWriter(PerTokenWriter):
+    """改动前的做法：在生成线程中直接插入"""
+    def write(self, text, tag=None):
+        self._insert(text, tag)
+
+
+def run(name, make_writer, tokens, rate):
+    root = tk.Tk()
+    root.geometry("200x300")
+    display = scrolledtext.ScrolledText(root, wrap=tk.WORD, height=10)
+    display.pack(fill=tk.BOTH, expand=True)
+    display.tag_configure("thinking", foreground="#6b7280")
+    writer = make_writer(display)
+    expected = "".join(text for text, _ in tokens)
+    thinking_length = sum(len(text) for text, tag in tokens if tag)
+    state = {"last_beat": time.perf_counter(), "max_gap": 0.0, "done_at": None, "producer_done": False}
+
+    def heartbeat():
+        now = time.perf_counter()
+        state["max_gap"] = max(state["max_gap"], now - state["last_beat"])
+        state["last_beat"] = now
+        if state["producer_done"] and display.get("1.0", "end-1c") == expected:
+            state["done_at"] = now
+            root.quit()
+            return
+        root.after(HEARTBEAT_MS, heartbeat)
+
+    def produce():
+        interval = 1 / rate if rate else 0
+        next_time = time.perf_counter()
+        for text, tag in tokens:
+            writer.write(text, tag)
+            if interval:
+                next_time += interval
+                time.sleep(max(0, next_time - time.perf_counter()))
+        state["producer_done"] = True
+
+    start = time.perf_counter()
+    root.after(0, heartbeat)
+    threading.Thread(target=produce, daemon=True).start()
+    root.mainloop()
+    elapsed = state["done_at"] - start
+    ranges = display.tag_ranges("thinking")
+    tagged = display.count(ranges[0], ranges[-1], "chars")[0] if ranges else 0
+    assert tagged == thinking_length, f"{name}: thinking 标签范围错误 ({tagged} != {thinking_length})"
+    root.destroy()
+    print(f"{name:<14}{elapsed * 1000:>12.0f}{writer.frames:>12}{state['max_gap'] * 1000:>16.1f}{len(tokens) / elapsed:>14.0f}")
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    count = int(args[0]) if args else 20000
+    rate = float(args[1]) if len(args) > 1 else 0
+    tokens = fake_tokens(count)
+    print(f"{count} 个 token，速率 {'不限' if not rate else f'{rate:.0f}/s'}")
+    print(f"{'方式':<14}{'总耗时(ms)':>12}{'insert 次数':>12}{'最大卡顿(ms)':>16}{'token/s':>14}")
+    run("逐个 after(0)", PerTokenWriter, tokens, rate)
+    run("TokenRenderer", TokenRenderer, tokens, rate)
+    if "--legacy-direct" in sys.argv:
+        run("跨线程直接插入", DirectWriter, tokens, rate)
+
+
+if __name__ == "__main__":
+    main()
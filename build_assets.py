@@ -0,0 +1,150 @@
+"""网页前端资源构建
+
+用法:
+    python build_assets.py --vendor    下载 index.html 引用的 CDN 库到 assets/vendor（需联网，只需运行一次）
+    python build_assets.py             生成 assets/dist：文件名带内容哈希，并预压缩为 .gz（安装了 brotli 时另生成 .br）
+
+构建后网页服务从 assets/dist 提供页面，第三方库不再依赖外网；未构建时仍使用 CDN。
+修改 assets 下的文件后需重新构建。
+"""
+import gzip
+import json
+import os
+import re
+import shutil
+import sys
+from hashlib import sha256
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSETS_DIR = 'assets'
+VENDOR_DIR = 'assets/vendor'
+DIST_DIR = 'assets/dist'
+LOCAL_ASSETS = ['script.js', 'style.css', 'favicon.ico']
+COMPRESSIBLE = {'.js', '.css', '.html', '.svg', '.ttf', '.json'}
+KNOWN_EXTENSIONS = {'.js', '.mjs', '.css', '.json', '.svg', '.ttf', '.woff', '.woff2', '.eot', '.png', '.ico'}
+CONTENT_TYPE_EXTENSIONS = {
+    'application/javascript': '.js',
+    'text/javascript': '.js',
+    'application/x-javascript': '.js',
+    'text/css': '.css',
+    'application/json': '.json',
+}
+REFERENCE_REGEX = re.compile(r'''(<(?:script|link)\b[^>]*?\b(?:src|href)=")([^"]+)(")''')
+CSS_URL_REGEX = re.compile(r'''url\((['"]?)([^'")]+)\1\)''')
+
+
+def vendor():
+    """下载 index.html 中引用的外部脚本和样式，以及样式表中引用的字体等文件"""
+    import requests
+    with open(f'{ASSETS_DIR}/index.html', 'r', encoding='utf-8') as f:
+        html = f.read()
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    mapping = {}
+    for _, url, _ in REFERENCE_REGEX.findall(html):
+        if not url.startswith('http'):
+            continue
+        response = requests.get(url, timeout=60)
+        response.raise_for_status()
+        # 按最终地址（跟随重定向后）保存，保留目录结构以便样式表中的相对路径仍然有效
+        parsed = urlsplit(response.url)
+        relative = f"{parsed.netloc}{parsed.path}"
+        # 如 cdn.tailwindcss.com 会重定向到 /3.4.17 这样的版本路径，“.17”不是扩展名，按 Content-Type 补上
+        if os.path.splitext(relative)[1] not in KNOWN_EXTENSIONS:
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            relative = relative.rstrip('/') + '/index' + CONTENT_TYPE_EXTENSIONS.get(content_type, '.js')
+        _write(f'{VENDOR_DIR}/{relative}', response.content)
+        mapping[url] = relative
+        print(f"{url} -> {relative} ({len(response.content) // 1024} KB)")
+        if relative.endswith('.css'):
+            for _, reference in CSS_URL_REGEX.findall(response.text):
+                if reference.startswith('data:'):
+                    continue
+                reference_url = urljoin(response.url, reference.split('?')[0].split('#')[0])
+                reference_parsed = urlsplit(reference_url)
+                content = requests.get(reference_url, timeout=60).content
+                _write(f'{VENDOR_DIR}/{reference_parsed.netloc}{reference_parsed.path}', content)
+    with open(f'{VENDOR_DIR}/vendor.json', 'w', encoding='utf-8') as f:
+        json.dump(mapping, f, ensure_ascii=False, indent=4)
+
+
+def build():
+    if os.path.exists(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+    vendored = {}
+    if os.path.exists(f'{VENDOR_DIR}/vendor.json'):
+        with open(f'{VENDOR_DIR}/vendor.json', 'r', encoding='utf-8') as f:
+            vendored = json.load(f)
+    else:
+        print("未找到 assets/vendor，第三方库仍从 CDN 加载（先运行 python build_assets.py --vendor）")
+
+    sources = [f'{ASSETS_DIR}/{name}' for name in LOCAL_ASSETS]
+    for root, _, files in os.walk(VENDOR_DIR):
+        sources += [os.path.join(root, name).replace('\\', '/') for name in files if name != 'vendor.json']
+    # 样式表引用字体，需在字体之后处理才能改写为带哈希的地址
+    sources.sort(key=lambda path: path.endswith('.css'))
+    manifest = {} # 源文件路径 -> 带哈希的文件名
+    for source in sources:
+        with open(source, 'rb') as f:
+            content = f.read()
+        if source.endswith('.css'):
+            content = _rewrite_css(source, content.decode('utf-8'), manifest).encode('utf-8')
+        stem, ext = os.path.splitext(os.path.basename(source))
+        name = f"{stem}.{sha256(content).hexdigest()[:12]}{ext}"
+        _emit(name, content)
+        manifest[source] = name
+
+    with open(f'{ASSETS_DIR}/index.html', 'r', encoding='utf-8') as f:
+        html = f.read()
+    def replace(match):
+        url = match.group(2)
+        source = f'{VENDOR_DIR}/{vendored[url]}' if url in vendored else f'{ASSETS_DIR}/{url}'
+        if source not in manifest:
+            return match.group(0)
+        return f"{match.group(1)}/static/{manifest[source]}{match.group(3)}"
+    html = REFERENCE_REGEX.sub(replace, html)
+    html = html.replace('<head>', f'<head>\n    <link rel="icon" href="/static/{manifest[f"{ASSETS_DIR}/favicon.ico"]}">', 1)
+    _emit('index.html', html.encode('utf-8'))
+    with open(f'{DIST_DIR}/manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    print(f"已生成 {len(manifest) + 1} 个文件到 {DIST_DIR}{'' if brotli else '（未安装 brotli，只生成 gzip）'}")
+
+
+def _rewrite_css(source: str, css: str, manifest: dict) -> str:
+    def replace(match):
+        reference = match.group(2)
+        if reference.startswith('data:') or reference.startswith('http'):
+            return match.group(0)
+        path = os.path.normpath(os.path.join(os.path.dirname(source), reference.split('?')[0].split('#')[0])).replace('\\', '/')
+        if path not in manifest:
+            return match.group(0)
+        suffix = reference[len(reference.split('?')[0].split('#')[0]):]
+        return f"url(/static/{manifest[path]}{suffix})"
+    return CSS_URL_REGEX.sub(replace, css)
+
+
+def _emit(name: str, content: bytes):
+    _write(f'{DIST_DIR}/{name}', content)
+    if os.path.splitext(name)[1] not in COMPRESSIBLE:
+        return
+    _write(f'{DIST_DIR}/{name}.gz', gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli:
+        _write(f'{DIST_DIR}/{name}.br', brotli.compress(content, quality=11))
+
+
+def _write(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if "--vendor" in sys.argv:
+        vendor()
+    build()
@@ -1,7 +1,10 @@
 import win32gui
 import win32ui
 import requests
-from openai import OpenAI
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit, parse_qs
+from openai import OpenAI, AsyncOpenAI
 from io import BytesIO
 import base64
 import pygetwindow as gw
@@ -21,14 +24,24 @@ from pystray import Icon, MenuItem, Menu
 import json
 import win32clipboard
 import win32con
-from hashlib import md5
+from hashlib import md5, sha256
 from tkinterdnd2 import DND_FILES, TkinterDnD
 import re
+import functools
+import atexit
+import zlib
+import tempfile
+import shutil
+import subprocess
 import sqlite3
 import multiprocessing
-from queue import Queue
+import asyncio
+import heapq
+from queue import Queue, Empty
+from concurrent.futures import Future, ThreadPoolExecutor
 
 oclients = {}
+aoclients = {}
 
 if os.path.exists('saves/models.json'):
     with open('saves/models.json', 'r', encoding='utf-8') as f:
@@ -38,6 +51,309 @@ else:
     raise FileNotFoundError("saves/models.json not found")
 
 
+def atomic_write(path: str, data: bytes):
+    """先写入同目录下的唯一临时文件再替换，托盘与网页服务两个进程同时写同一文件也不会互相覆盖半成品"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class _LazyInstance:
+    """模块级共享对象的代理：第一次访问属性时才创建实例，仅导入本模块不会打开数据库、建立会话或启动线程"""
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _get(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    object.__setattr__(self, '_instance', self._factory())
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+class HttpClient:
+    """内容提取器共用的 HTTP 会话：按主机复用连接池，默认超时，失败按指数退避重试，并记录每次请求耗时"""
+    def __init__(self, connect_timeout: float = 5, read_timeout: float = 60, long_read_timeout: float = 600, retries: int = 3, backoff_factor: float = 0.5, pool_connections: int = 16, pool_maxsize: int = 8, log: bool = True):
+        self.timeout = (connect_timeout, read_timeout)
+        self.long_timeout = (connect_timeout, long_read_timeout) # 下载音频、语音转写等耗时请求
+        self.log = log
+        # 默认只重试幂等方法（不含 POST）
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        # retry="status"：计费的 POST 接口，只在服务端明确拒绝（限流、暂不可用）时重试，超时与连接中断不重试，避免重复提交
+        status_retry = Retry(
+            total=retries,
+            connect=0,
+            read=0,
+            other=0,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 503),
+            allowed_methods=None,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        # retry="none"：探测等需要快速失败的请求，不重试
+        self.sessions = {
+            "default": self._session(retry, pool_connections, pool_maxsize),
+            "status": self._session(status_retry, pool_connections, pool_maxsize),
+            "none": self._session(0, pool_connections, pool_maxsize),
+        }
+        self.session = self.sessions["default"]
+
+    @staticmethod
+    def _session(retry, pool_connections: int, pool_maxsize: int) -> requests.Session:
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method: str, url: str, timeout=None, retry: str = "default", **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        try:
+            response = self.sessions[retry].request(method, url, timeout=timeout or self.timeout, **kwargs)
+        except requests.RequestException as e:
+            if self.log:
+                print(f"[http] {method} {self._short_url(url)} 失败 {(time.perf_counter() - start) * 1000:.0f}ms: {e}")
+            raise
+        if self.log:
+            print(f"[http] {method} {self._short_url(url)} {response.status_code} {(time.perf_counter() - start) * 1000:.0f}ms")
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    @staticmethod
+    def _short_url(url: str) -> str:
+        # 日志中不输出查询参数（可能包含签名）
+        parsed = urlsplit(url)
+        return f"{parsed.netloc}{parsed.path}"
+
+http_client = _LazyInstance(lambda: HttpClient(**models.get("http-client", {})))
+
+class DiskCache:
+    """提取结果的磁盘缓存 (SQLite)：按命名空间设置 TTL，总大小超出上限时按最近访问时间做 LRU 淘汰，并统计命中率"""
+    def __init__(self, path: str = 'saves/extractor_cache.db', max_bytes: int = 256 * 1024 * 1024, log: bool = True):
+        self.max_bytes = max_bytes
+        self.log = log
+        self.lock = threading.Lock()
+        self.stats: dict[str, list[int]] = {} # namespace -> [命中, 未命中]
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT,
+                    key TEXT,
+                    value TEXT,
+                    size INTEGER,
+                    expires REAL,
+                    accessed REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            ''')
+            self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    def get(self, namespace: str, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires > ?", (namespace, key, now)).fetchone()
+            if row:
+                with self.conn:
+                    self.conn.execute("UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+            counter = self.stats.setdefault(namespace, [0, 0])
+            counter[0 if row else 1] += 1
+        if self.log:
+            print(f"[cache] {namespace} {'命中' if row else '未命中'}，命中率 {self.hit_rate(namespace):.0%}")
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value, ttl: float):
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)", (namespace, key, data, len(data.encode('utf-8')), now + ttl, now))
+            self.conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+            total = self.conn.execute("SELECT coalesce(sum(size), 0) FROM cache").fetchone()[0]
+            if total > self.max_bytes:
+                evict = []
+                for row_namespace, row_key, size in self.conn.execute("SELECT namespace, key, size FROM cache ORDER BY accessed"):
+                    if total <= self.max_bytes:
+                        break
+                    evict.append((row_namespace, row_key))
+                    total -= size
+                self.conn.executemany("DELETE FROM cache WHERE namespace = ? AND key = ?", evict)
+
+    def hit_rate(self, namespace: str | None = None) -> float:
+        counters = [self.stats.get(namespace, [0, 0])] if namespace else list(self.stats.values())
+        hits = sum(c[0] for c in counters)
+        total = hits + sum(c[1] for c in counters)
+        return hits / total if total else 0.0
+
+    def report(self) -> dict:
+        """各命名空间的命中次数、未命中次数与命中率"""
+        return {namespace: {"hits": hits, "misses": misses, "hit_rate": self.hit_rate(namespace)} for namespace, (hits, misses) in self.stats.items()}
+
+extractor_cache = _LazyInstance(lambda: DiskCache(**models.get("extractor-cache", {})))
+
+def cached_extractor(namespace: str, ttl: float, key):
+    """在提取函数前加一层 extractor_cache，key(*args, **kwargs) 生成缓存键"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            value = extractor_cache.get(namespace, cache_key)
+            if value is None:
+                value = func(*args, **kwargs)
+                extractor_cache.set(namespace, cache_key, value, ttl)
+            return value
+        return wrapper
+    return decorator
+
+def _bili_cache_key(user_input: str, progress=None) -> str:
+    """视频编号（BV/av 号，短链接取地址）加分P，同一视频的不同分P分别缓存"""
+    path, _, query = user_input.partition('?')
+    part = parse_qs(query).get('p', ['1'])[0].rstrip('/')
+    bvid = re.search(r'[Bb][Vv]([0-9A-Za-z]{10})', path)
+    avid = re.search(r'(?:^|/)[Aa][Vv](\d+)', path)
+    if bvid:
+        video = f"BV{bvid.group(1)}"
+    elif avid:
+        video = f"av{avid.group(1)}"
+    else: # b23.tv 等短链接
+        parsed = urlsplit(path if '://' in path else f'https://{path}')
+        video = f"{parsed.netloc}{parsed.path}".rstrip('/')
+    return f"{video}:p{part or 1}"
+
+def _image_cache_key(image: Image.Image) -> str:
+    return sha256(f"{image.mode}{image.size}".encode() + image.tobytes()).hexdigest()
+
+class PerceptualCache:
+    """按感知哈希 (dHash) 缓存图片的处理结果：尺寸相同且汉明距离不超过 threshold 的截图视为同一张，
+    条目数超过 max_entries 时按 LRU 淘汰，持久化为 saves/ 下的 JSON 文件（修改后延迟 save_delay 秒合并写盘，不占用查询锁）"""
+    def __init__(self, path: str = 'saves/ocr_phash_cache.json', hash_size: int = 32, threshold: int = 8, max_entries: int = 512, save_delay: float = 5.0):
+        self.path = path
+        self.hash_size = hash_size
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.save_delay = save_delay
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock() # 只串行化写文件
+        self.save_timer: threading.Timer | None = None
+        self.version = 0 # 每次修改加一，避免较旧的快照覆盖较新的文件
+        self.saved_version = 0
+        self.entries: OrderedDict[tuple[int, int, int], str] = OrderedDict() # (宽, 高, 哈希) -> 结果
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data["hash_size"] == hash_size: # 哈希尺寸改变后旧条目无法比较，直接丢弃
+                for width, height, phash, value in data["entries"]:
+                    self.entries[(width, height, int(phash, 16))] = value
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取感知哈希缓存失败: {e}")
+        atexit.register(self.flush)
+
+    def phash(self, image: Image.Image) -> int:
+        # 缩放为 (hash_size + 1) x hash_size 的灰度图，比较每行相邻像素的明暗
+        size = self.hash_size
+        pixels = image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR).tobytes()
+        value = 0
+        for row in range(size):
+            offset = row * (size + 1)
+            for col in range(size):
+                value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+        return value
+
+    def get(self, image: Image.Image):
+        width, height = image.size
+        phash = self.phash(image)
+        with self.lock:
+            best, best_distance = None, self.threshold + 1
+            for key in self.entries:
+                if key[0] == width and key[1] == height:
+                    distance = (key[2] ^ phash).bit_count()
+                    if distance < best_distance:
+                        best, best_distance = key, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(best)
+            return self.entries[best]
+
+    def set(self, image: Image.Image, value: str):
+        key = (*image.size, self.phash(image))
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.version += 1
+            if self.save_timer is None:
+                self.save_timer = threading.Timer(self.save_delay, self.flush)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+
+    def flush(self):
+        """把当前条目写入磁盘；锁内只复制条目，序列化与写文件在锁外进行"""
+        with self.lock:
+            if self.save_timer is None:
+                return
+            self.save_timer.cancel()
+            self.save_timer = None
+            entries = [[width, height, f"{phash:x}", value] for (width, height, phash), value in self.entries.items()]
+            version = self.version
+        with self.save_lock:
+            if version <= self.saved_version:
+                return
+            self.saved_version = version
+            atomic_write(self.path, json.dumps({"hash_size": self.hash_size, "entries": entries}, ensure_ascii=False).encode('utf-8'))
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+ocr_phash_cache = _LazyInstance(lambda: PerceptualCache(**models.get("ocr-cache", {})))
+
+def perceptual_cached(cache: PerceptualCache):
+    """相似截图直接复用之前的结果，不再重新编码和发起请求"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(image: Image.Image):
+            value = cache.get(image)
+            if value is None:
+                value = func(image)
+                cache.set(image, value)
+            else:
+                print(f"[cache] 相似截图命中，命中率 {cache.hit_rate():.0%}")
+            return value
+        return wrapper
+    return decorator
+
 def ask_ai(system: str, user: str, model: str = "deepseek-chat", prefix: str = "", stop: str = ""):
     messages = [{"role": "system", "content": system}, {"role": "user", "content": user}]
     if prefix:
@@ -53,6 +369,190 @@ def ask_ai(system: str, user: str, model: str = "deepseek-chat", prefix: str = "
     response = get_oclient(model).chat.completions.create(**params)
     return response.choices[0].message.content
 
+async def ask_ai_async(system: str, user: str, model: str = "deepseek-chat", prefix: str = "", stop: str = ""):
+    """ask_ai 的异步版本"""
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": user}]
+    if prefix:
+        messages.append({"role": "assistant", "content": prefix, "prefix": True})
+    params = {
+        "model": model,
+        "messages": messages,
+        "temperature": 0,
+        "stream": False,
+    }
+    if stop:
+        params["stop"] = stop
+    response = await get_async_oclient(model).chat.completions.create(**params)
+    return response.choices[0].message.content
+
+TITLE_SYSTEM_PROMPT = "你是一个专业的对话标题生成器，你需要根据用户的输入生成一句对话标题。"
+TITLE_BATCH_SYSTEM_PROMPT = "你是一个专业的对话标题生成器。用户会给出一个 JSON 数组，每一项是一段对话的首条输入，你需要为每一项生成一句对话标题，按相同顺序输出为 JSON 字符串数组。"
+TITLE_INPUT_CHARS = 1000 # 过长的输入只取首尾各一半生成标题
+TITLE_CACHE_TTL = 30 * 86400
+
+def normalize_title_input(text: str) -> str:
+    """合并空白并截断，作为标题请求的输入与记忆化的键"""
+    text = " ".join(text.split())
+    if len(text) > TITLE_INPUT_CHARS:
+        half = TITLE_INPUT_CHARS // 2
+        text = text[:half] + "\n...\n" + text[-half:]
+    return text
+
+def title_input(content: list[dict]) -> str | None:
+    """用户消息中最后一段文字，用于生成标题；只有图片时返回 None"""
+    texts = [item["text"] for item in content if item.get("type") == "text" and item.get("text")]
+    return texts[-1] if texts else None
+
+class TitleService:
+    """对话标题生成服务：固定数量的工作线程 + 有界等待队列，按服务商（接口地址）令牌桶限速。
+    相同的（模型, 规范化输入）只请求一次：进行中的请求共享同一个 Future，结果存入 extractor_cache。
+    模型配置了 "title_batch": true 时，同一模型排队中的多个对话合并为一次请求；
+    模型可用 "requests_per_minute" 覆盖默认限速"""
+    def __init__(self, workers: int = 2, max_pending: int = 64, requests_per_minute: float = 60, burst: int = 5, batch_size: int = 8, batch_window: float = 0.05, log: bool = True):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.batch_size = batch_size
+        self.batch_window = batch_window # 开启合并时，首个对话入队后最多等待这么久凑批
+        self.log = log
+        self.condition = threading.Condition()
+        self.pending: dict[str, OrderedDict] = {} # model -> {key: (text, 入队时间)}
+        self.inflight: dict[str, Future] = {} # 排队中与请求中的 key -> Future
+        self.buckets: dict[str, tuple[float, float]] = {} # url -> (令牌数, 更新时间)
+        self.busy = 0
+        self.stats = {"requests": 0, "batched": 0, "deduplicated": 0, "memoized": 0, "rejected": 0}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="title")
+        self.thread = threading.Thread(target=self._dispatch, daemon=True)
+        self.thread.start()
+
+    def submit(self, text: str, model: str) -> Future:
+        """返回标题的 Future；队列已满时 Future 以异常结束"""
+        text = normalize_title_input(text)
+        key = sha256(f"{model}\n{text}".encode('utf-8')).hexdigest()
+        future = Future()
+        title = extractor_cache.get("title", key)
+        if title is not None:
+            with self.condition:
+                self.stats["memoized"] += 1
+            future.set_result(title)
+            return future
+        with self.condition:
+            if key in self.inflight:
+                self.stats["deduplicated"] += 1
+                return self.inflight[key]
+            if sum(len(queue) for queue in self.pending.values()) >= self.max_pending:
+                self.stats["rejected"] += 1
+                future.set_exception(RuntimeError("标题队列已满"))
+                return future
+            self.inflight[key] = future
+            self.pending.setdefault(model, OrderedDict())[key] = (text, time.monotonic())
+            self.condition.notify()
+        return future
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                while True:
+                    ready = self._next_batch()
+                    if isinstance(ready, tuple):
+                        break
+                    self.condition.wait(ready)
+                self.busy += 1
+            self.executor.submit(self._run, *ready)
+
+    def _next_batch(self):
+        """在锁内调用：返回可以发出的 (model, batch)，否则返回需要等待的秒数（None 为等待通知）"""
+        if self.busy >= self.workers:
+            return None
+        now = time.monotonic()
+        wait = None
+        for model, queue in self.pending.items():
+            if not queue:
+                continue
+            config = models.get(model, {})
+            batch_size = self.batch_size if config.get("title_batch") else 1
+            delay = next(iter(queue.values()))[1] + self.batch_window - now if len(queue) < batch_size else 0
+            if delay <= 0:
+                delay = self._take_token(config.get("url", model), config.get("requests_per_minute", self.requests_per_minute), now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            return model, [queue.popitem(last=False) for _ in range(min(batch_size, len(queue)))]
+        return wait
+
+    def _take_token(self, url: str, requests_per_minute: float, now: float) -> float:
+        """令牌桶：有令牌时取走并返回 0，否则返回还需等待的秒数"""
+        tokens, updated = self.buckets.get(url, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * requests_per_minute / 60)
+        if tokens >= 1:
+            self.buckets[url] = (tokens - 1, now)
+            return 0
+        self.buckets[url] = (tokens, now)
+        return (1 - tokens) * 60 / requests_per_minute
+
+    def _wait_token(self, model: str):
+        config = models.get(model, {})
+        while True:
+            with self.condition:
+                delay = self._take_token(config.get("url", model), config.get("requests_per_minute", self.requests_per_minute), time.monotonic())
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _run(self, model: str, batch: list[tuple[str, tuple[str, float]]]):
+        texts = [text for _, (text, _) in batch]
+        results = []
+        try:
+            titles = None
+            if len(batch) > 1:
+                try:
+                    titles = self._ask_batch(texts, model)
+                    if self.log:
+                        print(f"[title] {len(batch)} 个对话合并为一次请求")
+                except Exception as e:
+                    print(f"批量生成标题失败，改为逐个生成: {e}")
+            for i, (key, _) in enumerate(batch):
+                try:
+                    if titles is None:
+                        if i > 0:
+                            self._wait_token(model) # 逐个补发的请求同样受限速约束，第一个沿用发出这批时已取得的令牌
+                        title = ask_ai(TITLE_SYSTEM_PROMPT, texts[i], model=model, prefix="```标题\n", stop="\n```").strip()
+                        with self.condition:
+                            self.stats["requests"] += 1
+                    else:
+                        title = titles[i]
+                    extractor_cache.set("title", key, title, TITLE_CACHE_TTL)
+                    results.append((key, title, None))
+                except Exception as e:
+                    results.append((key, None, e))
+            if titles is not None:
+                with self.condition:
+                    self.stats["requests"] += 1
+                    self.stats["batched"] += len(batch)
+        finally:
+            with self.condition:
+                self.busy -= 1
+                futures = {key: self.inflight.pop(key) for key, _ in batch}
+                self.condition.notify()
+            done = {key for key, _, _ in results}
+            results += [(key, None, RuntimeError("标题生成中断")) for key in futures if key not in done]
+            for key, title, error in results:
+                if error is None:
+                    futures[key].set_result(title)
+                else:
+                    futures[key].set_exception(error)
+
+    @staticmethod
+    def _ask_batch(texts: list[str], model: str) -> list[str]:
+        answer = ask_ai(TITLE_BATCH_SYSTEM_PROMPT, json.dumps(texts, ensure_ascii=False), model=model, prefix="```json\n", stop="\n```")
+        titles = json.loads(answer.strip().removeprefix("```json").removesuffix("```"))
+        if not isinstance(titles, list) or len(titles) != len(texts) or not all(isinstance(title, str) for title in titles):
+            raise ValueError(f"返回的标题数量或格式不符: {answer[:200]}")
+        return [title.strip() for title in titles]
+
+title_service = _LazyInstance(lambda: TitleService(**models.get("title-service", {})))
+
 def capture_window_no_border(window: gw.Window) -> Image.Image | None:
     def capture_window(window):
         hwnd = window._hWnd
@@ -82,65 +582,54 @@ def capture_window_no_border(window: gw.Window) -> Image.Image | None:
         win32gui.ReleaseDC(hwnd, hwndDC)
         return im
 
-    def crop_black_borders(image):
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        width, height = image.size
-        if width == 0 or height == 0:
-            return image
-        pixels = image.load()
-        top = 0
-        for y in range(height):
-            for x in range(width):
-                if pixels[x, y] != (0, 0, 0):
-                    top = y
-                    break
-            else:
-                continue
-            break
-        bottom = height - 1
-        for y in range(height - 1, -1, -1):
-            for x in range(width):
-                if pixels[x, y] != (0, 0, 0):
-                    bottom = y
-                    break
-            else:
-                continue
-            break
-        left = 0
-        for x in range(width):
-            for y in range(height):
-                if pixels[x, y] != (0, 0, 0):
-                    left = x
-                    break
-            else:
-                continue
-            break
-        right = width - 1
-        for x in range(width - 1, -1, -1):
-            for y in range(height):
-                if pixels[x, y] != (0, 0, 0):
-                    right = x
-                    break
-            else:
-                continue
-            break
-        if left >= right or top >= bottom:
-            return image
-        cropped_image = image.crop((left, top, right + 1, bottom + 1))
-        return cropped_image
-    return crop_black_borders(capture_window(window))
+    image = capture_window(window)
+    if image is None:
+        return None
+    return crop_black_borders(image)
+
+def crop_black_borders(image: Image.Image) -> Image.Image:
+    """裁掉四周纯黑 (0, 0, 0) 的边框，借助 PIL 的 C 实现 getbbox 计算边界"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    width, height = image.size
+    if width == 0 or height == 0:
+        return image
+    # RGB 模式下 getbbox 返回任一通道非零的最小包围盒，即所有非纯黑像素的范围
+    bbox = image.getbbox()
+    if bbox is None:
+        return image
+    left, top, right, bottom = bbox
+    # 与逐像素扫描版本保持一致：内容只有一行或一列时不裁剪
+    if left >= right - 1 or top >= bottom - 1:
+        return image
+    return image.crop(bbox)
 
+OCR_TILE_SIZE = 2048 # 像素数超过 OCR_TILE_SIZE² 时分块识别，每块约 OCR_TILE_SIZE² 像素
+OCR_TILE_MAX_WIDTH = 8192 # 分块尽量横跨整幅宽度以免切断文字行，只有超过该宽度才纵向切开
+OCR_TILE_OVERLAP = 160 # 相邻分块的重叠像素，需大于一行文字的高度
+OCR_TILE_WORKERS = 4
+
+@perceptual_cached(ocr_phash_cache)
+@cached_extractor("ocr", ttl=90 * 86400, key=_image_cache_key)
 def ocr_image_azure(image: Image.Image) -> str:
-    # 将 PIL Image 转换为 PNG 字节流
     if models["azure-computer-vision"]["url"] == "xxx":
         raise Exception("请配置 Azure Computer Vision 的 URL 和 Ocp-Apim-Subscription-Key。如果没有，保持自动视觉模式开启。")
-    
+    config = models["azure-computer-vision"]
+    tile_size = config.get("tile_size", OCR_TILE_SIZE)
+    if image.size[0] * image.size[1] <= tile_size * tile_size:
+        lines = [line["text"] for line in _ocr_request(image)]
+    else:
+        lines = _ocr_tiled(image, tile_size, config.get("tile_max_width", OCR_TILE_MAX_WIDTH), config.get("tile_overlap", OCR_TILE_OVERLAP), config.get("tile_workers", OCR_TILE_WORKERS))
+    return "".join(line + "\n" for line in lines)
+
+def _ocr_request(image: Image.Image) -> list[dict]:
+    """识别一张图片，返回所有文本块中的行（含 boundingPolygon）"""
+    # 将 PIL Image 转换为 PNG 字节流
     img_byte_arr = BytesIO()
     image.save(img_byte_arr, format='PNG')
     img_byte_arr = img_byte_arr.getvalue()
     
-    data = requests.post(
+    data = http_client.post(
         url=models["azure-computer-vision"]["url"],
         headers={
             "Ocp-Apim-Subscription-Key": models["azure-computer-vision"]["Ocp-Apim-Subscription-Key"],
@@ -149,15 +638,56 @@ def ocr_image_azure(image: Image.Image) -> str:
         params={
             "features": "read"
         },
+        retry="status",
         data=img_byte_arr
     ).json()
     if "error" in data:
         raise Exception(data["error"]["message"])
-    lines = data["readResult"]["blocks"][0]
-    text = ""
-    for line in lines['lines']:
-        text += line['text'] + "\n"
-    return text
+    return [line for block in data["readResult"]["blocks"] for line in block["lines"]]
+
+def _tile_starts(length: int, tile_size: int, overlap: int) -> list[int]:
+    if length <= tile_size:
+        return [0]
+    return list(range(0, length - tile_size, tile_size - overlap)) + [length - tile_size]
+
+def _tile_bounds(starts: list[int], length: int, tile_size: int) -> list[tuple[float, float]]:
+    """每个分块负责的区间：以与相邻分块重叠部分的中线为界，行中心落在区间内的才保留，重叠处的行只出现一次"""
+    cuts = [0] + [(start + previous + tile_size) / 2 for previous, start in zip(starts, starts[1:])] + [length]
+    return list(zip(cuts, cuts[1:]))
+
+def _ocr_tiled(image: Image.Image, tile_size: int, max_width: int, overlap: int, workers: int) -> list[str]:
+    """将大图切成互相重叠的横条（过宽时再纵向切开）并发识别，去掉重叠处的重复行后按阅读顺序合并"""
+    width, height = image.size
+    tile_width = min(width, max_width)
+    tile_height = max(tile_size * tile_size // tile_width, overlap * 4)
+    xs = _tile_starts(width, tile_width, overlap)
+    ys = _tile_starts(height, tile_height, overlap)
+    tiles = [(x, y, x_bound, y_bound) for y, y_bound in zip(ys, _tile_bounds(ys, height, tile_height)) for x, x_bound in zip(xs, _tile_bounds(xs, width, tile_width))]
+    def recognize(tile):
+        x, y, (left, right), (top, bottom) = tile
+        result = []
+        for line in _ocr_request(image.crop((x, y, min(x + tile_width, width), min(y + tile_height, height)))):
+            points = line["boundingPolygon"]
+            line_xs = [x + point["x"] for point in points]
+            line_ys = [y + point["y"] for point in points]
+            center_x = (min(line_xs) + max(line_xs)) / 2
+            center_y = (min(line_ys) + max(line_ys)) / 2
+            if left <= center_x < right and top <= center_y < bottom:
+                result.append((min(line_xs), min(line_ys), max(line_ys), line["text"]))
+        return result
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        lines = [line for tile_lines in executor.map(recognize, tiles) for line in tile_lines]
+    # 按阅读顺序排列：纵向中心相差不到半行高的视为同一行，同一行内从左到右
+    lines.sort(key=lambda line: line[1])
+    rows: list[list[tuple]] = []
+    for line in lines:
+        if rows:
+            row_top, row_bottom = rows[-1][0][1], rows[-1][0][2]
+            if abs((line[1] + line[2]) / 2 - (row_top + row_bottom) / 2) < (row_bottom - row_top) / 2:
+                rows[-1].append(line)
+                continue
+        rows.append([line])
+    return [line[3] for row in rows for line in sorted(row, key=lambda line: line[0])]
 
 def image_to_b64(image: Image.Image) -> str:
     if image.mode != 'RGB':
@@ -167,6 +697,269 @@ def image_to_b64(image: Image.Image) -> str:
     img_byte_arr = img_byte_arr.getvalue()
     return base64.b64encode(img_byte_arr).decode('utf-8')
 
+JSON_GZIP_THRESHOLD = 16 * 1024 # 小于该字符数的 JSON（如标题列表）不压缩；按字符计，避免为判断大小再编码一遍
+JSON_GZIP_LEVEL = 1 # base64 图片几乎压不动，更高级别只会增加耗时
+JSON_GZIP_CHUNK_SIZE = 256 * 1024
+
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """按 Accept-Encoding 判断是否接受该编码：不区分大小写，明确列出的编码优先于 *，q=0 表示拒绝"""
+    qualities = {}
+    for item in accept_encoding.split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    quality = qualities.get(coding, qualities.get('*', 0.0))
+    return quality > 0
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    return accepts_encoding(accept_encoding, 'gzip')
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match 可以是逗号分隔的多个标签、W/ 弱标签或 *，按弱比较判断是否命中"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+def should_gzip_json(body: str, accept_encoding: str) -> bool:
+    return len(body) >= JSON_GZIP_THRESHOLD and accepts_gzip(accept_encoding)
+
+def iter_gzip(body: str):
+    """按块压缩并逐块产出，首个分块压缩完即可开始发送，不必等待整体压缩完成"""
+    compressor = zlib.compressobj(JSON_GZIP_LEVEL, zlib.DEFLATED, 31) # wbits=31 输出 gzip 格式
+    data = body.encode('utf-8')
+    for start in range(0, len(data), JSON_GZIP_CHUNK_SIZE):
+        # 每块后 Z_SYNC_FLUSH，让已压缩的数据立即交给客户端
+        chunk = compressor.compress(data[start:start + JSON_GZIP_CHUNK_SIZE]) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+STATIC_DIR = 'assets/dist' # build_assets.py 的输出
+STATIC_MIMETYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.json': 'application/json',
+    '.svg': 'image/svg+xml',
+    '.ico': 'image/x-icon',
+    '.woff2': 'font/woff2',
+    '.ttf': 'font/ttf',
+}
+
+def static_built() -> bool:
+    return os.path.exists(f'{STATIC_DIR}/index.html')
+
+def resolve_static(name: str, accept_encoding: str) -> tuple[str, str, str | None] | None:
+    """按 Accept-Encoding 选择预压缩文件，返回 (文件名, MIME 类型, Content-Encoding)，文件不存在时返回 None"""
+    if os.path.basename(name) != name or not os.path.isfile(f'{STATIC_DIR}/{name}'):
+        return None
+    mimetype = STATIC_MIMETYPES.get(os.path.splitext(name)[1], 'application/octet-stream')
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accepts_encoding(accept_encoding, encoding) and os.path.isfile(f'{STATIC_DIR}/{name}{suffix}'):
+            return name + suffix, mimetype, encoding
+    return name, mimetype, None
+
+BLOB_DIR = 'saves/blobs'
+BLOB_URL_PREFIX = '/blob/'
+DATA_URL_REGEX = re.compile(r'^data:image/([\w.+-]+);base64,')
+
+def store_blob(data_url: str) -> str:
+    """把 data URL 图片按 sha256 存入 saves/blobs，返回引用 URL；同一图片只存一份"""
+    match = DATA_URL_REGEX.match(data_url)
+    if not match:
+        return data_url
+    data = base64.b64decode(data_url[match.end():])
+    name = f"{sha256(data).hexdigest()}.{match.group(1)}"
+    folder = f'{BLOB_DIR}/{name[:2]}'
+    path = f'{folder}/{name}'
+    if not os.path.exists(path):
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        atomic_write(path, data)
+    return BLOB_URL_PREFIX + name
+
+def blob_path(ref: str) -> str:
+    """引用 URL 或文件名 -> 磁盘路径"""
+    name = ref.removeprefix(BLOB_URL_PREFIX)
+    if not re.fullmatch(r'[0-9a-f]{64}\.[\w.+-]+', name):
+        raise ValueError(f"无效的图片引用: {ref}")
+    return f'{BLOB_DIR}/{name[:2]}/{name}'
+
+def load_blob(ref: str) -> str:
+    """引用 URL -> data URL"""
+    with open(blob_path(ref), 'rb') as f:
+        data = f.read()
+    mime = ref.rsplit('.', 1)[1]
+    return f"data:image/{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+
+def _map_image_urls(messages: list[dict], func, should_map) -> list[dict]:
+    """对消息中的 image_url 逐个应用 func，仅复制发生变化的消息，原列表不变"""
+    result = []
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, list) or not any(item.get("type") == "image_url" and should_map(item["image_url"]["url"]) for item in content):
+            result.append(message)
+            continue
+        new_content = []
+        for item in content:
+            if item.get("type") == "image_url" and should_map(item["image_url"]["url"]):
+                item = {**item, "image_url": {**item["image_url"], "url": func(item["image_url"]["url"])}}
+            new_content.append(item)
+        result.append({**message, "content": new_content})
+    return result
+
+def dehydrate_messages(messages: list[dict]) -> list[dict]:
+    """内联图片 -> blob 引用，用于写入历史文件"""
+    return _map_image_urls(messages, store_blob, lambda url: url.startswith("data:image/"))
+
+def rehydrate_messages(messages: list[dict]) -> list[dict]:
+    """blob 引用 -> 内联图片，仅在发送给模型前调用"""
+    return _map_image_urls(messages, load_blob, lambda url: url.startswith(BLOB_URL_PREFIX))
+
+def history_path(chat_id: int) -> str:
+    return f'saves/histories/{chat_id // 1000}/{chat_id % 1000}'
+
+# 历史文件格式：
+#   旧格式 —— 整个文件是一个 JSON 数组
+#   新格式 —— 每行一条消息 (JSON Lines)，保存时只追加新消息
+# 两种格式都可读取；旧格式、内容不一致或存在写入中断留下的半行时整体重写（压缩）为新格式
+_history_lock = threading.Lock()
+_history_state: dict[int, tuple[int, int, str]] = {} # chat_id -> (已写入消息数, 文件大小, 最后一行)
+
+def _read_history_lines(text: str) -> tuple[list[str], bool]:
+    """返回 (有效行, 是否完整)；末尾无法解析的半行视为写入中断，丢弃"""
+    lines = [line for line in text.split('\n') if line.strip()]
+    if lines:
+        try:
+            json.loads(lines[-1])
+        except json.JSONDecodeError:
+            return lines[:-1], False
+    return lines, text.endswith('\n') or not text
+
+def _is_legacy_history(text: str) -> bool:
+    return text.lstrip().startswith('[')
+
+def _history_state_from_disk(chat_id: int) -> tuple[int, int, str] | None:
+    """读取磁盘上的文件状态，旧格式或不完整时返回 None 表示需要重写"""
+    path = history_path(chat_id)
+    if not os.path.exists(path):
+        return (0, 0, '')
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if _is_legacy_history(text):
+        return None
+    lines, complete = _read_history_lines(text)
+    if not complete:
+        return None
+    return (len(lines), os.path.getsize(path), lines[-1] if lines else '')
+
+def _compact_history(chat_id: int, messages: list[dict]):
+    path = history_path(chat_id)
+    lines = [json.dumps(message, ensure_ascii=False) for message in dehydrate_messages(messages)]
+    atomic_write(path, ''.join(line + '\n' for line in lines).encode('utf-8'))
+    _history_state[chat_id] = (len(lines), os.path.getsize(path), lines[-1] if lines else '')
+
+def save_history(chat_id: int, messages: list[dict]):
+    """保存对话历史，只追加上次保存之后新增的消息；图片写入 blob 存储，历史文件中只保留引用"""
+    folder = f'saves/histories/{chat_id // 1000}'
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    path = history_path(chat_id)
+    with _history_lock:
+        state = _history_state.get(chat_id)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if state is None or state[1] != size: # 内存中没有记录，或文件被其他进程改动过
+            state = _history_state_from_disk(chat_id)
+        if state is None:
+            _compact_history(chat_id, messages)
+            return
+        count, size, last_line = state
+        # 已写入的部分必须仍是当前消息的前缀，否则重写
+        if count > len(messages) or (count and json.dumps(dehydrate_messages(messages[count - 1:count])[0], ensure_ascii=False) != last_line):
+            _compact_history(chat_id, messages)
+            return
+        if count == len(messages):
+            return
+        lines = [json.dumps(message, ensure_ascii=False) for message in dehydrate_messages(messages[count:])]
+        with open(path, 'a', encoding='utf-8', newline='\n') as f:
+            f.write(''.join(line + '\n' for line in lines))
+        _history_state[chat_id] = (len(messages), os.path.getsize(path), lines[-1])
+
+def read_history_json(chat_id: int) -> str:
+    """以 JSON 数组文本返回历史，新格式只拼接各行，不解析消息内容"""
+    with open(history_path(chat_id), 'r', encoding='utf-8') as f:
+        text = f.read()
+    if _is_legacy_history(text):
+        return text
+    lines, _ = _read_history_lines(text)
+    return '[' + ','.join(lines) + ']'
+
+def read_history_since(chat_id: int, since: int) -> str:
+    """增量读取：返回 {"length": 消息总数, "messages": 第 since 条之后的消息} 的 JSON 文本。
+    新格式每行一条消息，直接截取行，不解析消息内容"""
+    with open(history_path(chat_id), 'r', encoding='utf-8') as f:
+        text = f.read()
+    if _is_legacy_history(text):
+        messages = json.loads(text)
+        return json.dumps({"length": len(messages), "messages": messages[since:]}, ensure_ascii=False)
+    lines, _ = _read_history_lines(text)
+    return f'{{"length": {len(lines)}, "messages": [{",".join(lines[since:])}]}}'
+
+def load_history(chat_id: int) -> list[dict]:
+    """读取对话历史（兼容新旧两种格式），图片保持为 blob 引用"""
+    return json.loads(read_history_json(chat_id))
+
+class ConversationCache:
+    """网页服务进程中最近返回过的已归档对话：chat_id -> (文件版本, ETag, JSON 文本)，按总字节数做 LRU 淘汰。
+    每次读取都核对文件的大小和修改时间，托盘进程写入的改动也能发现；/save 与超时归档时显式 invalidate"""
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[int, tuple[tuple[int, int], str, str]] = OrderedDict()
+
+    def get(self, chat_id: int) -> tuple[str, str] | None:
+        """返回 (ETag, JSON 文本)，文件不存在时返回 None"""
+        try:
+            stat = os.stat(history_path(chat_id))
+        except FileNotFoundError:
+            self.invalidate(chat_id)
+            return None
+        version = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            entry = self.entries.get(chat_id)
+            if entry and entry[0] == version:
+                self.entries.move_to_end(chat_id)
+                return entry[1], entry[2]
+        body = read_history_json(chat_id)
+        etag = sha256(body.encode('utf-8')).hexdigest()[:32]
+        with self.lock:
+            self._pop(chat_id)
+            self.entries[chat_id] = (version, etag, body)
+            self.total_bytes += len(body)
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                self._pop(next(iter(self.entries)))
+        return etag, body
+
+    def invalidate(self, chat_id: int):
+        with self.lock:
+            self._pop(chat_id)
+
+    def _pop(self, chat_id: int):
+        entry = self.entries.pop(chat_id, None)
+        if entry:
+            self.total_bytes -= len(entry[2])
+
 def get_oclient(model) -> OpenAI:
     if models[model]["url"] not in oclients:
         oclients[models[model]["url"]] = OpenAI(
@@ -175,7 +968,24 @@ def get_oclient(model) -> OpenAI:
         )
     return oclients[models[model]["url"]]
 
-def get_bili_text(user_input):
+def get_async_oclient(model) -> AsyncOpenAI:
+    if models[model]["url"] not in aoclients:
+        aoclients[models[model]["url"]] = AsyncOpenAI(
+            base_url=models[model]["url"],
+            api_key=models[model]["api_key"],
+        )
+    return aoclients[models[model]["url"]]
+
+BILI_SEGMENT_SECONDS = 300 # 转写时每段音频的时长
+BILI_MIN_AUDIO_BANDWIDTH = 48000 # 转写所需的最低音频码率 (bps)，一般的 64kbps AAC 音轨已足够
+BILI_PROBE_TIMEOUT = (3, 5)
+BILI_TRANSCRIBE_WORKERS = 4 # 同时转写的段数
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+@cached_extractor("bili", ttl=30 * 86400, key=_bili_cache_key)
+def get_bili_text(user_input, progress=None):
+    """progress(text) 用于报告下载与转写进度"""
+    report = progress or (lambda text: None)
     if user_input.startswith("BV") or user_input.startswith("av") or user_input.startswith("bv"):
         url = f"https://www.bilibili.com/video/{user_input}/"
     else:
@@ -183,7 +993,7 @@ def get_bili_text(user_input):
     header = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36 Edg/124.0.0.0"
     }
-    html = requests.get(url, headers=header).text
+    html = http_client.get(url, headers=header).text
     pat = r'''window.__INITIAL_STATE__=({.*?});'''
     res = re.findall(pat, html, re.DOTALL)
     data = json.loads(res[0])
@@ -194,82 +1004,838 @@ def get_bili_text(user_input):
     pat = r'''window.__playinfo__=({.*?})</script>'''
     res = re.findall(pat, html, re.DOTALL)
     data = json.loads(res[0])
-    for i in range(4):
-        if i == 3:
+    headers = {"referer": f'https://www.bilibili.com/video/{bv}/', "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36 Edg/127.0.0.0"}
+    with tempfile.TemporaryDirectory(prefix="bili-") as workdir:
+        audio_path = f'{workdir}/audio.m4a'
+        if not _download_bili_audio(data["data"]["dash"]["audio"], audio_path, headers, report):
             raise Exception("未找到合适的音频流。")
-        try:
-            headers = {"referer": f'https://www.bilibili.com/video/{bv}/', "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36 Edg/127.0.0.0"}
-            audio_url = data["data"]["dash"]["audio"][i]["baseUrl"]
-            audio_data = requests.get(audio_url, headers=headers)
-            if audio_data.status_code == 200 or audio_data.status_code == 206:
-                audio_data = audio_data.content
-                break
-        except:
-            pass
-    text = audio_transcription_azure(audio_data)
+        text = transcribe_audio_file(audio_path, report)
     return {'title': title, 'desc': desc, 'text': text, 'tag': tag}
 
+def rank_bili_audio_streams(streams: list[dict]) -> list[dict]:
+    """语音转写不需要高码率：AAC 优先，码率不低于 BILI_MIN_AUDIO_BANDWIDTH 的按从小到大排在前面，不足的按从大到小排在后面"""
+    def rank(stream: dict):
+        bandwidth = stream.get("bandwidth", 0)
+        codec_penalty = 0 if stream.get("codecs", "").startswith("mp4a") else 1
+        if bandwidth >= BILI_MIN_AUDIO_BANDWIDTH:
+            return (codec_penalty, 0, bandwidth)
+        return (codec_penalty, 1, -bandwidth)
+    return sorted(streams, key=rank)
+
+def _download_bili_audio(streams: list[dict], path: str, headers: dict, report) -> bool:
+    """按 rank_bili_audio_streams 的顺序尝试各音频流及其备用地址，下载前先探测地址是否可用"""
+    for stream in rank_bili_audio_streams(streams):
+        for url in _bili_stream_urls(stream):
+            if not _probe_url(url, headers):
+                print(f"音频流 {stream.get('id')} 不可用: {HttpClient._short_url(url)}")
+                continue
+            try:
+                if _download_to_file(url, path, headers, report):
+                    print(f"使用音频流 {stream.get('id')} ({stream.get('codecs')}, {stream.get('bandwidth', 0) // 1000}kbps)")
+                    return True
+            except Exception as e:
+                print(f"音频流 {stream.get('id')} 下载失败: {e}")
+    return False
+
+def _bili_stream_urls(stream: dict) -> list[str]:
+    return [stream["baseUrl"], *(stream.get("backupUrl") or stream.get("backup_url") or [])]
+
+def _probe_url(url: str, headers: dict) -> bool:
+    """只请求第一个字节，快速排除失效的 CDN 地址"""
+    try:
+        with http_client.get(url, headers={**headers, "Range": "bytes=0-0"}, stream=True, timeout=BILI_PROBE_TIMEOUT, retry="none") as response:
+            return response.status_code in (200, 206)
+    except requests.RequestException:
+        return False
+
+def _download_to_file(url: str, path: str, headers: dict, report) -> bool:
+    """分块流式写入磁盘，不在内存中保留整个文件"""
+    with http_client.get(url, headers=headers, stream=True, timeout=http_client.long_timeout) as response:
+        if response.status_code not in (200, 206):
+            return False
+        total = int(response.headers.get("Content-Length", 0))
+        done = 0
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                done += len(chunk)
+                report(f"下载 {done / 1048576:.1f}/{total / 1048576:.1f} MB" if total else f"下载 {done / 1048576:.1f} MB")
+    return True
+
+def transcribe_audio_file(path: str, progress=None) -> str:
+    """按时间切分音频并发转写后按顺序拼接；找不到 ffmpeg 时把整个文件流式上传转写"""
+    report = progress or (lambda text: None)
+    segments = _split_audio(path, BILI_SEGMENT_SECONDS)
+    if len(segments) <= 1:
+        report("转写中")
+        return audio_transcription_azure_file(path)
+    finished = 0
+    lock = threading.Lock()
+    def transcribe(segment: str) -> str:
+        nonlocal finished
+        with open(segment, 'rb') as f:
+            text = audio_transcription_azure(f.read())
+        with lock:
+            finished += 1
+            report(f"转写 {finished}/{len(segments)}")
+        return text
+    report(f"转写 0/{len(segments)}")
+    with ThreadPoolExecutor(max_workers=BILI_TRANSCRIBE_WORKERS) as executor:
+        return "".join(executor.map(transcribe, segments))
+
+_ffmpeg_warned = False
+
+def _split_audio(path: str, segment_seconds: int) -> list[str]:
+    """用 ffmpeg 无损切分（-c copy），返回按时间顺序排列的分段文件；ffmpeg 不可用时返回原文件"""
+    global _ffmpeg_warned
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        if not _ffmpeg_warned:
+            _ffmpeg_warned = True
+            print("未找到 ffmpeg，音频不切分，整体转写（较慢）。安装 ffmpeg 并加入 PATH 后可分段并发转写")
+        return [path]
+    folder = os.path.dirname(path)
+    result = subprocess.run(
+        [ffmpeg, "-v", "error", "-i", path, "-f", "segment", "-segment_time", str(segment_seconds), "-c", "copy", "-reset_timestamps", "1", f"{folder}/segment%04d.m4a"],
+        capture_output=True,
+    )
+    segments = sorted(f"{folder}/{name}" for name in os.listdir(folder) if name.startswith("segment"))
+    if result.returncode != 0 or not segments:
+        print(f"音频切分失败: {result.stderr.decode(errors='replace')}")
+        return [path]
+    return segments
+
+TRANSCRIPTION_DEFINITION = '{"locales":["zh-CN", "en-US", "ja-JP"]}'
+
+@cached_extractor("transcription", ttl=90 * 86400, key=lambda audio_data: sha256(audio_data).hexdigest())
 def audio_transcription_azure(audio_data: bytes) -> str:
-    response = requests.post(
+    response = http_client.post(
         url=models["azure-speech-to-text"]["url"],
         headers={
             "Ocp-Apim-Subscription-Key": models["azure-speech-to-text"]["Ocp-Apim-Subscription-Key"]
         },
         files={'audio': ('test.mp3', audio_data, 'audio/mpeg')},
-        data={'definition': '{"locales":["zh-CN", "en-US", "ja-JP"]}'}
+        data={'definition': TRANSCRIPTION_DEFINITION},
+        timeout=http_client.long_timeout,
+        retry="status",
     ).json()
+    return _transcription_text(response)
+
+def _file_sha256(path: str) -> str:
+    digest = sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# 与 audio_transcription_azure 共用缓存命名空间：内容相同则键相同
+@cached_extractor("transcription", ttl=90 * 86400, key=_file_sha256)
+def audio_transcription_azure_file(path: str) -> str:
+    """与 audio_transcription_azure 相同，但从文件分块读取上传，不把整个文件读入内存"""
+    with _MultipartFileBody(path, 'audio', 'test.mp3', 'audio/mpeg', {'definition': TRANSCRIPTION_DEFINITION}) as body:
+        response = http_client.post(
+            url=models["azure-speech-to-text"]["url"],
+            headers={
+                "Ocp-Apim-Subscription-Key": models["azure-speech-to-text"]["Ocp-Apim-Subscription-Key"],
+                "Content-Type": body.content_type,
+            },
+            data=body,
+            timeout=http_client.long_timeout,
+            retry="status",
+        ).json()
+    return _transcription_text(response)
+
+def _transcription_text(response: dict) -> str:
     text = ""
     for i in response["phrases"]:
         text += i["text"] + "\n"
     return text
 
-def get_netease_music_details_text(song_id, comment_limit=5):
-    lyric_api = f"https://music.163.com/api/song/lyric?os=pc&id={song_id}&lv=-1&tv=-1"
-    comment_api = f"https://music.163.com/api/v1/resource/comments/R_SO_4_{song_id}?offset=0&limit=3"
-    details_api = f"https://music.163.com/api/song/detail/?ids=[{song_id}]"
-    combined = ""
+class _MultipartFileBody:
+    """multipart/form-data 请求体：表单字段 + 一个文件，按需从磁盘读取。
+    提供 __len__ 以便 requests 设置 Content-Length，提供 seek/tell 以便 urllib3 重试时回到开头"""
+    def __init__(self, path: str, field: str, filename: str, mimetype: str, fields: dict):
+        boundary = os.urandom(16).hex()
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = "".join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n' for name, value in fields.items())
+        head += f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\nContent-Type: {mimetype}\r\n\r\n'
+        self.head = head.encode('utf-8')
+        self.tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        self.file = open(path, 'rb')
+        self.file_size = os.path.getsize(path)
+        self.position = 0
+
+    def __len__(self):
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, position: int, whence: int = 0):
+        self.position = position if whence == 0 else len(self) + position if whence == 2 else self.position + position
+        if len(self.head) <= self.position < len(self.head) + self.file_size:
+            self.file.seek(self.position - len(self.head))
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self) - self.position
+        parts = []
+        while size > 0 and self.position < len(self):
+            head_end = len(self.head)
+            file_end = head_end + self.file_size
+            if self.position < head_end:
+                chunk = self.head[self.position:self.position + size]
+            elif self.position < file_end:
+                self.file.seek(self.position - head_end)
+                chunk = self.file.read(min(size, file_end - self.position))
+            else:
+                chunk = self.tail[self.position - file_end:self.position - file_end + size]
+            if not chunk:
+                break
+            parts.append(chunk)
+            self.position += len(chunk)
+            size -= len(chunk)
+        return b"".join(parts)
 
-    lyric_json = requests.get(lyric_api).json()
+NETEASE_TIME_TAG_REGEX = re.compile(r'\[(?:\d{2,}:)?\d{2}[:.]\d{2,}(?:\.\d+)?\]')
+
+def _merge_netease_lyrics(lyric_json: dict) -> str:
+    """原文歌词与翻译按时间标签逐行合并"""
     translations = {}
-    time_tag_regex = r'\[(?:\d{2,}:)?\d{2}[:.]\d{2,}(?:\.\d+)?\]'
     if "tlyric" in lyric_json and lyric_json["tlyric"]["version"] and lyric_json["tlyric"]["lyric"]:
         for line in lyric_json["tlyric"]["lyric"].split("\n"):
-            time_tag = re.match(time_tag_regex, line)
+            time_tag = NETEASE_TIME_TAG_REGEX.match(line)
             if time_tag:
-                cleaned_line = re.sub(time_tag_regex, '', line).strip()
-                translations[time_tag.group()] = cleaned_line
+                translations[time_tag.group()] = NETEASE_TIME_TAG_REGEX.sub('', line).strip()
     combined_lyrics = []
     for line in lyric_json["lrc"]["lyric"].split("\n"):
-        time_tag = re.match(time_tag_regex, line)
+        time_tag = NETEASE_TIME_TAG_REGEX.match(line)
         if time_tag:
-            cleaned_line = re.sub(time_tag_regex, '', line).strip()
-            combined_lyrics.append(cleaned_line)
+            combined_lyrics.append(NETEASE_TIME_TAG_REGEX.sub('', line).strip())
             if time_tag.group() in translations:
                 combined_lyrics.append(translations[time_tag.group()])
-    combined_lyrics_text = "\n".join(combined_lyrics).strip()
+    return "\n".join(combined_lyrics).strip()
 
-    detail_json = requests.get(details_api).json()
-    song_detail_json = detail_json["songs"][0]
+def _format_netease_song(song_detail_json: dict, lyric_json: dict, comment_json: dict, comment_limit: int) -> str:
     name = song_detail_json["name"]
     artists = [artist["name"] for artist in song_detail_json["artists"]]
     transname = song_detail_json["transName"] if "transName" in song_detail_json else None
     alias = song_detail_json["alias"][0] if "alias" in song_detail_json and song_detail_json["alias"] else None
-
-    comment_json = requests.get(comment_api).json()
-    hot_comments = comment_json["hotComments"]
-    comments = [comment["content"] for comment in hot_comments][:comment_limit]
+    comments = [comment["content"] for comment in comment_json["hotComments"]][:comment_limit]
     comments_text = "\n\n".join(comments).strip()
+    combined = ""
     combined += f"曲名: {name}\n"
     combined += f"翻译名: {transname}\n" if transname else ""
     combined += f"别名: {alias}\n" if alias else ""
     combined += f"歌手: {', '.join(artists)}\n"
-    combined += f"歌词:\n```\n{combined_lyrics_text}\n```\n"
+    combined += f"歌词:\n```\n{_merge_netease_lyrics(lyric_json)}\n```\n"
     combined += f"热评:\n```\n{comments_text}\n```"
     return combined
 
+def get_netease_music_details_texts(song_ids: list, comment_limit: int = 5, max_workers: int = 6) -> list[str | None]:
+    """批量获取多首歌曲：详情一次请求取回，歌词和评论在有界线程池中并发获取，结果按输入顺序返回，失败的歌曲为 None"""
+    song_ids = [str(song_id) for song_id in song_ids]
+    cached = {song_id: extractor_cache.get("netease", f"{song_id}:{comment_limit}") for song_id in song_ids}
+    missing = [song_id for song_id in song_ids if cached[song_id] is None]
+    if missing:
+        for song_id, text in zip(missing, _fetch_netease_songs(missing, comment_limit, max_workers)):
+            if text is not None:
+                extractor_cache.set("netease", f"{song_id}:{comment_limit}", text, ttl=7 * 86400) # 热评会变化，缓存时间较短
+                cached[song_id] = text
+    return [cached[song_id] for song_id in song_ids]
+
+def _fetch_netease_songs(song_ids: list[str], comment_limit: int, max_workers: int) -> list[str | None]:
+    details_api = f"https://music.163.com/api/song/detail/?ids=[{','.join(song_ids)}]"
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        detail_future = executor.submit(lambda: http_client.get(details_api).json())
+        lyric_futures = [executor.submit(lambda song_id=song_id: http_client.get(f"https://music.163.com/api/song/lyric?os=pc&id={song_id}&lv=-1&tv=-1").json()) for song_id in song_ids]
+        comment_futures = [executor.submit(lambda song_id=song_id: http_client.get(f"https://music.163.com/api/v1/resource/comments/R_SO_4_{song_id}?offset=0&limit=3").json()) for song_id in song_ids]
+        details = {str(song["id"]): song for song in detail_future.result()["songs"]}
+        results = []
+        for song_id, lyric_future, comment_future in zip(song_ids, lyric_futures, comment_futures):
+            try:
+                results.append(_format_netease_song(details[song_id], lyric_future.result(), comment_future.result(), comment_limit))
+            except Exception as e:
+                print(f"获取网易云音乐 {song_id} 失败: {e}")
+                results.append(None)
+    return results
+
+def get_netease_music_details_text(song_id, comment_limit=5):
+    text = get_netease_music_details_texts([song_id], comment_limit)[0]
+    if text is None:
+        raise Exception(f"获取网易云音乐 {song_id} 失败")
+    return text
+
+def get_netease_playlist_song_ids(playlist_id, limit: int = 20) -> list[str]:
+    data = http_client.get(f"https://music.163.com/api/v6/playlist/detail?id={playlist_id}").json()
+    return [str(track["id"]) for track in data["playlist"]["trackIds"][:limit]]
+
+SEARCH_ROWID_BITS = 20
+CJK_CHARS = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff66-\uff9f'
+CJK_CHAR_REGEX = re.compile(f'([{CJK_CHARS}])')
+CJK_SPACING_REGEX = re.compile(f' *([{CJK_CHARS}]) *')
+
+def segment_cjk(text: str) -> str:
+    """unicode61 分词器不切分中日韩文字，这里在每个 CJK 字符两侧加空格，使其按单字索引，查询时按短语匹配相邻的字"""
+    return CJK_CHAR_REGEX.sub(r' \1 ', text)
+
+def message_text(message: dict) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        return "\n".join(item["text"] for item in content if item.get("type") == "text")
+    return content or ""
+
+def _search_rowid_range(chat_id: int) -> tuple[int, int]:
+    low = chat_id << SEARCH_ROWID_BITS
+    return low, low + (1 << SEARCH_ROWID_BITS) - 1
+
+def _fts_query(text: str) -> str:
+    """把用户输入转为 FTS5 查询：每个空格分隔的词作为一个短语，多个词之间为 AND"""
+    phrases = []
+    for term in text.split():
+        tokens = segment_cjk(term).split()
+        if tokens:
+            phrases.append('"' + " ".join(tokens).replace('"', '""') + '"')
+    return " ".join(phrases)
+
+class TitleStore:
+    """history_titles.db 的访问层：查询从有上限的只读连接池中借用连接（WAL 模式下读写互不阻塞），
+    所有写操作交给单个写线程，排队中的写入合并到同一个事务里提交"""
+    def __init__(self, path: str = 'saves/history_titles.db', max_batch: int = 256, max_readers: int = 4):
+        self.path = path
+        self.max_batch = max_batch
+        self.max_readers = max_readers
+        conn = sqlite3.connect(path, timeout=5)
+        with conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+            # 每条消息一行，rowid = chat_id << SEARCH_ROWID_BITS | 消息序号，便于按对话做范围删除
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, tokenize = 'unicode61')")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS titles (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT
+                )
+            ''')
+            # backfill：已加入索引的最后一个历史对话 id，全部完成后为 'done'，中断后下次启动时从这里继续
+            conn.execute("CREATE TABLE IF NOT EXISTS search_meta (key TEXT PRIMARY KEY, value)")
+        backfill = conn.execute("SELECT value FROM search_meta WHERE key = 'backfill'").fetchone()
+        conn.close()
+        self.readers: Queue = Queue() # 空闲的只读连接
+        self.reader_count = 0
+        self.reader_lock = threading.Lock()
+        self.closed = False
+        self.close_lock = threading.Lock() # 保证关闭后不再有写入排到结束标记之后
+        self.listeners = []
+        self.write_queue: Queue = Queue()
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+        if backfill is None or backfill[0] != 'done':
+            threading.Thread(target=self._backfill_search_index, args=(backfill[0] if backfill else -1,), daemon=True).start()
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        if readonly:
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=5, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA cache_size = -64000")
+        return conn
+
+    def query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """借用一个只读连接执行查询，用完归还；连接数达到上限时等待其他查询归还"""
+        conn = self._acquire_reader()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self.readers.put(conn)
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self.readers.get_nowait()
+        except Empty:
+            pass
+        with self.reader_lock:
+            create = self.reader_count < self.max_readers
+            if create:
+                self.reader_count += 1
+        if not create:
+            return self.readers.get()
+        try:
+            return self._connect(readonly=True)
+        except Exception:
+            with self.reader_lock:
+                self.reader_count -= 1
+            raise
+
+    def list_titles(self, below: int | None = None, above: int | None = None, limit: int = 20) -> list[dict]:
+        if below is not None:
+            rows = self.query("SELECT id, title FROM titles WHERE id < ? ORDER BY id DESC LIMIT ?", (below, limit))
+        elif above is not None:
+            rows = self.query("SELECT id, title FROM titles WHERE id > ? ORDER BY id ASC LIMIT ?", (above, limit))
+        else:
+            rows = self.query("SELECT id, title FROM titles ORDER BY id DESC LIMIT ?", (limit,))
+        return [{'id': row[0], 'title': row[1]} for row in rows]
+
+    def execute(self, sql: str, params: tuple = ()) -> Future:
+        """提交写操作，返回的 Future 结果为 lastrowid"""
+        return self._enqueue(sql, params)
+
+    def run(self, func) -> Future:
+        """在写线程的事务中执行 func(conn)，返回的 Future 结果为 func 的返回值"""
+        return self._enqueue(func, None)
+
+    def _enqueue(self, sql, params) -> Future:
+        future = Future()
+        with self.close_lock:
+            if self.closed:
+                future.set_exception(RuntimeError("TitleStore 已关闭"))
+            else:
+                self.write_queue.put((sql, params, future))
+        return future
+
+    def add_listener(self, callback):
+        """标题增删改提交后调用 callback({"type": "insert" | "update" | "delete", "id": ..., "title": ...})，在写线程中执行"""
+        self.listeners.append(callback)
+
+    def _notify(self, future: Future, event_type: str, chat_id: int | None, title: str | None):
+        def done(future: Future):
+            if future.exception() is not None:
+                return
+            event = {"type": event_type, "id": future.result() if chat_id is None else chat_id, "title": title}
+            for callback in self.listeners:
+                try:
+                    callback(event)
+                except Exception as e:
+                    print(f"标题事件处理失败: {e}")
+        future.add_done_callback(done)
+        return future
+
+    def insert_title(self, title: str) -> Future:
+        return self._notify(self.execute("INSERT INTO titles (title) VALUES (?)", (title,)), "insert", None, title)
+
+    def update_title(self, chat_id: int, title: str) -> Future:
+        return self._notify(self.execute("UPDATE titles SET title = ? WHERE id = ?", (title, chat_id)), "update", chat_id, title)
+
+    def delete_title(self, chat_id: int) -> Future:
+        def delete(conn: sqlite3.Connection):
+            conn.execute("DELETE FROM titles WHERE id = ?", (chat_id,))
+            conn.execute("DELETE FROM messages_fts WHERE rowid BETWEEN ? AND ?", _search_rowid_range(chat_id))
+        return self._notify(self.run(delete), "delete", chat_id, None)
+
+    def index_chat(self, chat_id: int, messages: list[dict]) -> Future:
+        """增量更新全文索引：只写入尚未索引的消息，消息变少（被重写）时整段重建"""
+        messages = list(messages) # 写线程稍后才执行，先复制一份，调用方之后继续追加消息不受影响
+        return self.run(lambda conn: self._index_messages(conn, chat_id, messages))
+
+    @staticmethod
+    def _index_messages(conn: sqlite3.Connection, chat_id: int, messages: list[dict]):
+        low, high = _search_rowid_range(chat_id)
+        last = conn.execute("SELECT max(rowid) FROM messages_fts WHERE rowid BETWEEN ? AND ?", (low, high)).fetchone()[0]
+        start = 0 if last is None else last - low + 1
+        if start > len(messages):
+            conn.execute("DELETE FROM messages_fts WHERE rowid BETWEEN ? AND ?", (low, high))
+            start = 0
+        conn.executemany(
+            "INSERT INTO messages_fts (rowid, content) VALUES (?, ?)",
+            [(low + i, segment_cjk(message_text(messages[i]))) for i in range(start, len(messages))]
+        )
+
+    def search(self, text: str, limit: int = 20) -> list[dict]:
+        """全文搜索，每个对话只返回相关度最高的一条消息片段"""
+        match = _fts_query(text)
+        if not match:
+            return []
+        results = []
+        seen = set()
+        page = limit * 5
+        offset = 0
+        # 同一对话可能占据多行，按页继续读取，直到凑够 limit 个对话或没有更多结果
+        while len(results) < limit:
+            try:
+                rows = self.query(f"""
+                    SELECT messages_fts.rowid >> {SEARCH_ROWID_BITS}, titles.title, snippet(messages_fts, 0, char(2), char(3), '…', 16)
+                    FROM messages_fts JOIN titles ON titles.id = messages_fts.rowid >> {SEARCH_ROWID_BITS}
+                    WHERE messages_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ? OFFSET ?
+                """, (match, page, offset))
+            except sqlite3.OperationalError:
+                return results
+            for chat_id, title, snippet in rows:
+                if chat_id in seen:
+                    continue
+                seen.add(chat_id)
+                snippet = CJK_SPACING_REGEX.sub(r'\1', snippet).replace('\x03\x02', '').replace('\x02', '【').replace('\x03', '】')
+                results.append({'id': chat_id, 'title': title, 'snippet': snippet})
+                if len(results) >= limit:
+                    break
+            if len(rows) < page:
+                break
+            offset += page
+        return results
+
+    def _backfill_search_index(self, progress: int):
+        """把已有的历史文件加入索引，按 id 顺序进行，每个对话与进度在同一事务中提交"""
+        chat_ids = []
+        if os.path.exists('saves/histories'):
+            for folder in os.listdir('saves/histories'):
+                if not folder.isdigit():
+                    continue
+                chat_ids += [int(folder) * 1000 + int(name) for name in os.listdir(f'saves/histories/{folder}') if name.isdigit()]
+        for chat_id in sorted(chat_ids):
+            if chat_id <= progress:
+                continue
+            try:
+                messages = load_history(chat_id)
+            except Exception as e:
+                print(f"索引 {chat_id} 失败: {e}")
+                continue
+            def index(conn: sqlite3.Connection, chat_id=chat_id, messages=messages):
+                self._index_messages(conn, chat_id, messages)
+                conn.execute("INSERT OR REPLACE INTO search_meta VALUES ('backfill', ?)", (chat_id,))
+            self.run(index)
+        self.execute("INSERT OR REPLACE INTO search_meta VALUES ('backfill', 'done')")
+
+    def close(self):
+        """等待已排队的写入完成后关闭写线程与只读连接，之后的写入直接以异常结束"""
+        with self.close_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.write_queue.put(None)
+        self.writer_thread.join()
+        while True:
+            try:
+                self.readers.get_nowait().close()
+            except Empty:
+                break
+
+    def _writer_loop(self):
+        conn = self._connect(readonly=False)
+        closing = False
+        while not closing:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.write_queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self._commit_batch(conn, batch)
+        conn.close()
+
+    def _commit_batch(self, conn: sqlite3.Connection, batch: list):
+        try:
+            with conn:
+                results = [self._apply(conn, sql, params) for sql, params, _ in batch]
+        except sqlite3.Error:
+            # 整批失败时逐条重试，避免一条坏语句拖累同批的其他写入
+            for sql, params, future in batch:
+                try:
+                    with conn:
+                        future.set_result(self._apply(conn, sql, params))
+                except sqlite3.Error as e:
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    @staticmethod
+    def _apply(conn: sqlite3.Connection, sql, params):
+        if callable(sql):
+            return sql(conn)
+        return conn.execute(sql, params).lastrowid
+
+class EventBroker:
+    """把事件分发给所有已连接的客户端（/events）。订阅者是不阻塞的投递函数（如有界 Queue 的 put_nowait），
+    投递失败（队列已满）时丢弃该事件，慢客户端不会拖住发布方"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers: list = []
+
+    def subscribe(self, deliver):
+        with self.lock:
+            self.subscribers.append(deliver)
+
+    def unsubscribe(self, deliver):
+        with self.lock:
+            if deliver in self.subscribers:
+                self.subscribers.remove(deliver)
+
+    def publish(self, event: dict):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for deliver in subscribers:
+            try:
+                deliver(event)
+            except Exception:
+                pass
+
+def format_sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def validate_title_event(data) -> dict | None:
+    """检查 POST /events 提交的标题事件，格式不对时返回 None"""
+    if not isinstance(data, dict) or data.get("type") not in ("insert", "update", "delete"):
+        return None
+    chat_id, title = data.get("id"), data.get("title")
+    if not isinstance(chat_id, int) or isinstance(chat_id, bool):
+        return None
+    if not isinstance(title, str) and not (data["type"] == "delete" and title is None):
+        return None
+    return {"type": data["type"], "id": chat_id, "title": title}
+
+def is_loopback(address: str | None) -> bool:
+    return address in ("127.0.0.1", "::1", "::ffff:127.0.0.1")
+
+class ExpiryScheduler:
+    """用一个线程和截止时间堆管理所有对话的超时，代替每个对话一个轮询线程"""
+    def __init__(self, timeout: float, on_expire, batch_window: float = 1.0):
+        self.timeout = timeout
+        self.on_expire = on_expire # 回调参数为一批已过期的 key 列表
+        self.batch_window = batch_window # 最早的截止时间到达后再等这么久，期间到期的对话合并为一批处理（只会推迟，不会提前）
+        self.deadlines: dict = {}
+        self.heap: list[tuple[float, int]] = []
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def touch(self, key):
+        """登记或续期，旧的堆条目不删除，弹出时按 deadlines 判断是否过时"""
+        with self.condition:
+            deadline = time.monotonic() + self.timeout
+            self.deadlines[key] = deadline
+            heapq.heappush(self.heap, (deadline, key))
+            if self.heap[0][1] == key:
+                self.condition.notify()
+
+    def discard(self, key):
+        with self.condition:
+            self.deadlines.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def __len__(self):
+        """当前存活的会话数"""
+        return len(self.deadlines)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    # 丢弃已续期或已移除的过时条目
+                    while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+                        heapq.heappop(self.heap)
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    wait = self.heap[0][0] + self.batch_window - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                expired = []
+                now = time.monotonic()
+                while self.heap and self.heap[0][0] <= now:
+                    deadline, key = heapq.heappop(self.heap)
+                    if self.deadlines.get(key) == deadline:
+                        del self.deadlines[key]
+                        expired.append(key)
+            if expired:
+                try:
+                    self.on_expire(expired)
+                except Exception as e:
+                    print(e)
+
+IMAGE_TOKENS = 1000 # 单张图片的估算 token 数
+OMITTED_IMAGE_TEXT = "[较早的图片已省略]"
+_summary_cache: OrderedDict = OrderedDict() # 摘要输入的哈希 -> 摘要，多个 ChatInstance 共享
+_summary_lock = threading.Lock()
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+
+def estimate_tokens(message: dict) -> int:
+    """本地粗略估算：CJK 字符按 1 token，其余字符按 4 个 1 token，图片按固定值"""
+    content = message.get("content")
+    items = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+    tokens = 4
+    for item in items:
+        if item.get("type") == "image_url":
+            tokens += IMAGE_TOKENS
+        else:
+            text = item.get("text", "")
+            cjk = len(CJK_CHAR_REGEX.findall(text))
+            tokens += cjk + (len(text) - cjk) // 4
+    return tokens
+
+class ContextWindow:
+    """按 models.json 中的配置裁剪发送给模型的上下文：
+    context_budget —— token 预算，超出时把较早的轮次压缩为摘要（未配置摘要模型时直接丢弃）
+    keep_images —— 只保留最近几条带图片的用户消息中的图片"""
+    def __init__(self, summary_model: str | None = None, low_water: float = 0.7, summary_wait: float = 2.0):
+        self.summary_model = summary_model
+        self.low_water = low_water # 超出预算时一次裁剪到预算的该比例，避免每轮都重新摘要
+        self.summary_wait = summary_wait # 摘要在后台生成，最多等待这么久；未完成时本轮先发送未裁剪的上下文
+        self.summarized = 0 # messages[:summarized] 已被摘要替代
+        self.summary = ""
+        self.pending: tuple[int, int, Future] | None = None # 进行中的摘要 (起点, 终点, Future)
+
+    def build(self, messages: list[dict], model: str) -> list[dict]:
+        config = models.get(model, {})
+        messages = self._strip_old_images(messages, config.get("keep_images"))
+        budget = config.get("context_budget")
+        if not budget:
+            return messages
+        if self.summarized > len(messages): # 消息被替换过，重新开始
+            self.summarized = 0
+            self.summary = ""
+            self.pending = None
+        self._apply_pending(0)
+        tokens = [estimate_tokens(message) for message in messages]
+        summary_tokens = estimate_tokens({"content": self.summary}) if self.summary else 0
+        if summary_tokens + sum(tokens[self.summarized:]) > budget:
+            # 按轮次（以 user 消息开头）向后推进，当前这一轮始终保留
+            turn_starts = [i for i in range(self.summarized + 1, len(messages)) if messages[i]["role"] == "user"]
+            target = budget * self.low_water
+            start = self.summarized
+            for turn_start in turn_starts:
+                start = turn_start
+                if summary_tokens + sum(tokens[start:]) <= target:
+                    break
+            if start > self.summarized and self.pending is None:
+                future = _summary_executor.submit(self._summarize, self.summary, messages[self.summarized:start])
+                self.pending = (self.summarized, start, future)
+                self._apply_pending(self.summary_wait)
+        if not self.summarized:
+            return messages
+        result = []
+        if self.summary:
+            result.append({"role": "system", "content": f"以下是之前对话的摘要：\n{self.summary}"})
+        result.extend(messages[self.summarized:])
+        return result
+
+    @staticmethod
+    def _strip_old_images(messages: list[dict], keep_images: int | None) -> list[dict]:
+        if keep_images is None:
+            return messages
+        result = []
+        kept = 0
+        for message in reversed(messages):
+            content = message.get("content")
+            if isinstance(content, list) and any(item.get("type") == "image_url" for item in content):
+                if kept < keep_images:
+                    kept += 1
+                else:
+                    message = {**message, "content": [item if item.get("type") != "image_url" else {"type": "text", "text": OMITTED_IMAGE_TEXT} for item in content]}
+            result.append(message)
+        result.reverse()
+        return result
+
+    def _apply_pending(self, timeout: float):
+        """摘要完成后才推进窗口；失败时保留原窗口，下次超出预算时重试"""
+        if self.pending is None:
+            return
+        begin, end, future = self.pending
+        if not future.done():
+            try:
+                future.exception(timeout)
+            except Exception: # 超时，摘要仍在生成
+                return
+        self.pending = None
+        summary = future.result()
+        if summary is None or begin != self.summarized:
+            return
+        self.summary = summary
+        self.summarized = end
+
+    def _summarize(self, previous: str, messages: list[dict]) -> str | None:
+        """增量摘要：在上一次摘要的基础上合并新移出窗口的消息，结果按输入哈希缓存；失败返回 None"""
+        if not self.summary_model:
+            return ""
+        transcript = "\n".join(f"{'用户' if message['role'] == 'user' else 'AI'}: {message_text(message)}" for message in messages)
+        key = sha256(f"{self.summary_model}\n{previous}\n{transcript}".encode("utf-8")).hexdigest()
+        with _summary_lock:
+            if key in _summary_cache:
+                _summary_cache.move_to_end(key)
+                return _summary_cache[key]
+        user = f"已有摘要：\n{previous}\n\n新增对话：\n{transcript}" if previous else transcript
+        try:
+            summary = ask_ai("你是一个对话摘要器，请用简洁的中文概括对话中的关键信息、结论和未完成的问题。", user, model=self.summary_model)
+        except Exception as e:
+            print(f"摘要生成失败: {e}")
+            return None
+        with _summary_lock:
+            _summary_cache[key] = summary
+            if len(_summary_cache) > 256:
+                _summary_cache.popitem(last=False)
+        return summary
+
+class TokenRenderer:
+    """把流式输出的片段先缓冲起来，在 Tk 线程中按不超过 fps 的频率合并写入文本框。
+    write 可从任意线程调用，相邻的同标签片段合并，一帧只调用一次 insert，标签保持不变"""
+    def __init__(self, widget: tk.Text, fps: int = 30):
+        self.widget = widget
+        self.interval = 1000 // fps
+        self.lock = threading.Lock()
+        self.pending: list[list] = [] # [文本, 标签]
+        self.scheduled = False
+        self.last_flush = 0.0
+        self.frames = 0
+        self.tk_thread = threading.current_thread() # 创建文本框的线程
+
+    def write(self, text: str, tag: str | None = None):
+        if threading.current_thread() is self.tk_thread:
+            self.flush()
+            self._insert([[text, tag]])
+            return
+        with self.lock:
+            if self.pending and self.pending[-1][1] == tag:
+                self.pending[-1][0] += text
+            else:
+                self.pending.append([text, tag])
+            if self.scheduled:
+                return
+            self.scheduled = True
+        delay = max(0, int(self.last_flush * 1000 + self.interval - time.perf_counter() * 1000))
+        self.widget.after(delay, self.flush)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            self.scheduled = False
+        if pending:
+            self._insert(pending)
+            self.last_flush = time.perf_counter()
+            self.frames += 1
+
+    def discard(self):
+        """丢弃尚未写入的片段，清空文本框前调用"""
+        with self.lock:
+            self.pending = []
+
+    def _insert(self, runs: list[list]):
+        args = []
+        for text, tag in runs:
+            args += [text, tag or ()]
+        self.widget.insert(tk.END, *args)
+
 class ChatInstance:
-    def __init__(self, model = "deepseek-chat", vision_model = "qwen3-vl-plus-2025-12-19", messages: list[dict] | None = None, mainwindow = None):
+    def __init__(self, model = "deepseek-chat", vision_model = "qwen3-vl-plus-2025-12-19", messages: list[dict] | None = None, mainwindow = None, assist_model: str | None = None):
         self.oclient = get_oclient(model)
+        self.context = ContextWindow(summary_model=assist_model)
         self.model = model
         self.vision_model = vision_model
         self.messages: list[dict] = messages if messages else []
@@ -290,7 +1856,7 @@ class ChatInstance:
     def ai(self):
         completion = self.oclient.chat.completions.create(
             model=self.model,
-            messages=self.messages,
+            messages=rehydrate_messages(self.context.build(self.messages, self.model)),
             temperature=1,
             stream=True
         )
@@ -341,6 +1907,36 @@ class ChatInstance:
                 yield {"data": delta.content}
         self.messages.append({"role": "assistant", "content": full_content})
 
+    async def stream_async(self):
+        """_yield_mode 的异步版本，直接从 AsyncOpenAI 的流中产出数据"""
+        completion = await get_async_oclient(self.model).chat.completions.create(
+            model=self.model,
+            messages=await asyncio.to_thread(lambda: rehydrate_messages(self.context.build(self.messages, self.model))),
+            temperature=1,
+            stream=True
+        )
+        full_content = ""
+        is_thinking = False
+        is_answering = False
+        try:
+            async for chunk in completion:
+                delta = chunk.choices[0].delta
+                if hasattr(delta, "reasoning_content") and delta.reasoning_content:
+                    if not is_thinking:
+                        is_thinking = True
+                        yield {"signal": 1}
+                    yield {"data": delta.reasoning_content}
+                elif hasattr(delta, "content") and delta.content:
+                    if is_thinking and not is_answering:
+                        is_answering = True
+                        yield {"signal": 0}
+                    full_content += delta.content
+                    yield {"data": delta.content}
+        finally:
+            # 客户端中途断开时也保留已收到的内容
+            self.messages.append({"role": "assistant", "content": full_content})
+            await completion.close()
+
     def new(self):
         self.messages.append({"role": "user", "content": []})
     
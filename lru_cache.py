@@ -0,0 +1,109 @@
+"""不依赖 Windows/Tk 的 LRU 缓存，可单独导入（如基准测试）"""
+from collections import OrderedDict
+
+def estimate_size(value) -> int:
+    """粗略估算对象占用的字节数，只统计字符串和字节串（截图的 base64 占绝大部分）"""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimate_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value)
+    return 8
+
+class LRUCache:
+    def __init__(self, capacity=50, allow_reverse=False, max_bytes=None, sizer=None):
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        self.allow_reverse = allow_reverse
+        # 只有开启反向查询时才初始化字典，节省空间
+        self.rev_cache = {} if allow_reverse else None
+        # 按内存预算淘汰：sizer(value) 返回值的大小，总和超过 max_bytes 时淘汰最旧项
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+        self.sizes = {} if sizer else None
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __contains__(self, key):
+        """只判断是否存在，不计入命中率，也不改变淘汰顺序"""
+        return key in self.cache
+
+    def get(self, key):
+        if key not in self.cache:
+            self.misses += 1
+            return None
+        self.hits += 1
+        
+        # 移动到最新位置 (MRU)
+        self.cache.move_to_end(key)
+        val = self.cache[key]
+        
+        # 如果支持反向查询，既然这个key刚被访问过，它就是这个值对应的“最新”键
+        if self.allow_reverse:
+            self.rev_cache[val] = key
+            
+        return val
+    
+    def put(self, key, value):
+        if key in self.cache:
+            # key 已存在：移动到最新位置
+            self.cache.move_to_end(key)
+            
+            # 处理反向索引更新
+            if self.allow_reverse:
+                old_val = self.cache[key]
+                # 如果值发生了变化，且旧值的反向索引指向当前key，则删除旧索引
+                if old_val != value and self.rev_cache.get(old_val) == key:
+                    del self.rev_cache[old_val]
+        elif len(self.cache) >= self.capacity:
+            # key 不存在：检查容量，弹出最旧项 (FIFO)
+            self._evict_oldest()
+        
+        # 更新主缓存
+        self.cache[key] = value
+        
+        # 更新反向索引：无论 value 是否重复，当前 key 都是该 value 的“最新”代表
+        if self.allow_reverse:
+            self.rev_cache[value] = key
+
+        if self.sizer:
+            size = self.sizer(value)
+            self.total_bytes += size - self.sizes.get(key, 0)
+            self.sizes[key] = size
+            # 超出内存预算时淘汰最旧项，刚放入的一项始终保留
+            while self.max_bytes is not None and self.total_bytes > self.max_bytes and len(self.cache) > 1:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        old_k, old_v = self.cache.popitem(last=False)
+        self.evictions += 1
+        if self.sizer:
+            self.total_bytes -= self.sizes.pop(old_k)
+        
+        # 如果被删除的键是其值的反向索引代表，则清理反向索引
+        # 注意：如果 rev_cache[old_v] 指向的是别的（更新的）key，则不删除
+        if self.allow_reverse and self.rev_cache.get(old_v) == old_k:
+            del self.rev_cache[old_v]
+            
+    def find_key(self, value):
+        """
+        通过值反向查询键。
+        如果多个键对应同一个值，返回最新的（最后被 put 或 get 的）那个键。
+        """
+        if not self.allow_reverse:
+            return None
+        return self.rev_cache.get(value)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.cache),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
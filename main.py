@@ -1,4 +1,7 @@
 from individual_modules import *
+from lru_cache import LRUCache, estimate_size
+
+HISTORY_RENDER_TURNS = 20 # 打开历史对话时先显示的轮数，向上滚动到顶部时每次再加载同样多
 
 class MainWindow:
     def __init__(self, width=200, height=300, shift=10, taskbar_height=60):
@@ -33,23 +36,9 @@ class MainWindow:
         if not os.path.exists('saves/histories'):
             os.makedirs('saves/histories')
 
-        is_db_exist = os.path.exists('saves/history_titles.db')
-        self.conn = sqlite3.connect('saves/history_titles.db', check_same_thread=False, timeout=5)
-        with self.conn:
-            cursor = self.conn.cursor()
-            if not is_db_exist:
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS titles (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        title TEXT
-                    )
-                ''')
-                cursor.execute("PRAGMA journal_mode = WAL")
-                cursor.execute("PRAGMA synchronous=NORMAL")
-            cursor.execute("PRAGMA busy_timeout = 3417")
-            cursor.execute("PRAGMA cache_size = -64000")
+        self.title_store = TitleStore()
+        self.title_store.add_listener(self._forward_title_event)
         self.history_titles = []
-        self.history_cache = LRUCache(50)
 
         self.last_active_window = None
         self.manual_extra_data = []
@@ -64,6 +53,8 @@ class MainWindow:
         self.main_model = "deepseek-chat"
         self.assist_model = "qwen-flash"
         self.vision_model = "qwen3-vl-plus-2025-12-19"
+        self.web_server_mode = "threaded" # "threaded" 使用 Flask，"async" 使用 asyncio
+        self.history_cache_bytes = 256 * 1024 * 1024 # 历史对话缓存的内存预算
 
         if os.path.exists('saves/settings.json'):
             with open('saves/settings.json', 'r', encoding='utf-8') as f:
@@ -76,6 +67,10 @@ class MainWindow:
             self.main_model = settings["main_model"]
             self.assist_model = settings["assist_model"]
             self.vision_model = settings["vision_model"]
+            self.web_server_mode = settings.get("web_server_mode", "threaded")
+            self.history_cache_bytes = settings.get("history_cache_bytes", self.history_cache_bytes)
+
+        self.history_cache = LRUCache(50, max_bytes=self.history_cache_bytes, sizer=estimate_size)
         
         if self.is_feature_screenshot_enable:
             self.get_active_window_thread = threading.Thread(target=self._get_active_window_loop)
@@ -87,22 +82,20 @@ class MainWindow:
             self.browser_backend.run_server()
         
         if self.is_feature_web_server_enable:
-            from server import _run_server
-            self.web_server = multiprocessing.Process(target=_run_server, args=(self.main_model, self.vision_model, self.assist_model))
-            self.web_server.daemon = True
-            self.web_server.start()
+            self._start_web_server()
         
         self.display_area.tag_configure("user", foreground="#2563eb")
         self.display_area.tag_configure("assistant", foreground="#059669")
         self.display_area.tag_configure("thinking", foreground="#6b7280")
         self.display_area.tag_configure("answering", foreground="#dc2626")
+        self.renderer = TokenRenderer(self.display_area)
+        self.history_turns: list[list] = [] # 当前历史对话中每一轮要显示的内容
+        self.history_rendered_from = 0 # history_turns[history_rendered_from:] 已显示
+        self.display_area.config(yscrollcommand=self._on_display_yscroll)
 
     def insert_message(self, message: str, tag: str | None = None):
-        """插入消息到显示区域"""
-        if tag:
-            self.display_area.insert(tk.END, message, tag)
-        else:
-            self.display_area.insert(tk.END, message)
+        """插入消息到显示区域，生成线程中的调用会被缓冲后在 Tk 线程中按帧合并写入"""
+        self.renderer.write(message, tag)
 
     def on_enter_key(self, event):
         if event.state & 0x0001:  # Shift被按住
@@ -139,14 +132,15 @@ class MainWindow:
         self.chatinstance()
         self.insert_message("\n")
 
-    def _generate_and_insert_chat_title(self, user_input: str):
-        title = ask_ai("你是一个专业的对话标题生成器，你需要根据用户的输入生成一句对话标题。", user_input, model=self.assist_model, prefix="```标题\n", stop="\n```")
-        with self.conn:
-            cursor = self.conn.cursor()
-            cursor.execute("UPDATE titles SET title = ? WHERE id = ?", (title, self.current_chat_index))
-        if hasattr(self, 'history_listbox'):
-            self.history_listbox.delete(0)
-            self.history_listbox.insert(0, title)
+    def _insert_chat_title(self, chat_id: int, future: Future):
+        """title_service 完成后回调（在其工作线程中），按 id 更新，期间切换了对话也不会写错"""
+        try:
+            title = future.result()
+        except Exception as e:
+            print(f"标题生成失败 {chat_id}: {e}")
+            return
+        self.title_store.update_title(chat_id, title)
+        self.root.after(0, self._apply_title_event, {"type": "update", "id": chat_id, "title": title})
     
     def open_settings(self):
         if hasattr(self, 'settings_root'):  # 如果窗口已打开
@@ -195,11 +189,7 @@ class MainWindow:
         self.is_feature_web_server_enable = enable
         trayicon.set_menu_shortcut(enable)
         if enable:
-            if not hasattr(globals(), '_run_server'):
-                from server import _run_server
-            self.web_server: multiprocessing.Process = multiprocessing.Process(target=_run_server, args=(self.main_model, self.vision_model, self.assist_model))
-            self.web_server.daemon = True
-            self.web_server.start()
+            self._start_web_server()
         else:
             if hasattr(self, 'web_server'):
                 requests.get('http://127.0.0.1:3417/save-all')
@@ -207,6 +197,70 @@ class MainWindow:
                 self.web_server.join(timeout=1)
                 del self.web_server
     
+    def _start_web_server(self):
+        if self.web_server_mode == "async":
+            from server_async import _run_async_server as run_server
+        else:
+            from server import _run_server as run_server
+        self.web_server: multiprocessing.Process = multiprocessing.Process(target=run_server, args=(self.main_model, self.vision_model, self.assist_model))
+        self.web_server.daemon = True
+        self.web_server.start()
+        if not hasattr(self, 'title_events_thread') or not self.title_events_thread.is_alive():
+            self.title_events_thread = threading.Thread(target=self._title_events_loop, daemon=True)
+            self.title_events_thread.start()
+
+    def _forward_title_event(self, event: dict):
+        """托盘自己写入的标题变化转发给网页服务，由它推送给所有网页客户端"""
+        if self.is_feature_web_server_enable:
+            threading.Thread(target=self._post_title_event, args=(event,), daemon=True).start()
+
+    @staticmethod
+    def _post_title_event(event: dict):
+        try:
+            requests.post('http://127.0.0.1:3417/events', json=event, timeout=2)
+        except requests.RequestException:
+            pass
+
+    def _title_events_loop(self):
+        """订阅网页服务的 /events，把网页端产生的标题变化同步到历史记录窗口；服务未就绪或断开时重连"""
+        while self.is_feature_web_server_enable:
+            try:
+                with requests.get('http://127.0.0.1:3417/events', stream=True, timeout=(2, 30)) as response:
+                    event_name = None
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not self.is_feature_web_server_enable:
+                            return
+                        if line.startswith('event:'):
+                            event_name = line[6:].strip()
+                        elif line.startswith('data:') and event_name == 'title':
+                            self.root.after(0, self._apply_title_event, json.loads(line[5:]))
+            except requests.RequestException:
+                pass
+            time.sleep(3)
+
+    def _apply_title_event(self, event: dict):
+        """按 id 幂等地应用标题事件，自己转发出去又收回来的事件不会重复生效"""
+        index = next((i for i, item in enumerate(self.history_titles) if item['id'] == event['id']), None)
+        has_listbox = hasattr(self, 'history_listbox') and self.history_listbox.winfo_exists()
+        filtering = hasattr(self, 'history_filter_var') and self.history_filter_var.get().strip()
+        if event['type'] == 'insert':
+            if index is not None or filtering or (self.history_titles and event['id'] < self.history_titles[0]['id']):
+                return
+            self.history_titles.insert(0, {'id': event['id'], 'title': event['title']})
+            if has_listbox:
+                self.history_listbox.insert(0, event['title'])
+        elif index is None:
+            return
+        elif event['type'] == 'update':
+            self.history_titles[index]['title'] = event['title']
+            if has_listbox:
+                self.history_listbox.delete(index)
+                self.history_listbox.insert(index, event['title'])
+        elif event['type'] == 'delete':
+            del self.history_titles[index]
+            if has_listbox:
+                self.history_listbox.delete(index)
+    
     def _set_feature_browser_backend(self, enable: bool):
         self.is_feature_browser_backend_enable = enable
         if enable:
@@ -260,6 +314,12 @@ class MainWindow:
         self.history_root.bind('<Unmap>', lambda event: self.history_root.withdraw())
         self.history_root.bind('<Delete>', self._remove_history)
 
+        # 全文搜索过滤框
+        self.history_filter_var = tk.StringVar()
+        self.history_filter_entry = ttk.Entry(self.history_root, textvariable=self.history_filter_var, font=('微软雅黑', 10))
+        self.history_filter_entry.pack(fill=tk.X, side=tk.TOP)
+        self.history_filter_entry.bind('<KeyRelease>', self._on_history_filter)
+
         self.history_frame = ttk.Frame(self.history_root)
         self.history_frame.pack(fill=tk.BOTH, expand=True)
 
@@ -275,17 +335,30 @@ class MainWindow:
         # 绑定选择事件
         self.history_listbox.bind('<<ListboxSelect>>', self._on_history_select)
         # 加载最后20条记录
-        with self.conn:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT id, title FROM titles ORDER BY id DESC LIMIT 20")
-            self.history_titles = [{'id': row[0], 'title': row[1]} for row in cursor.fetchall()]
-            print(self.history_titles)
+        self.history_titles = self.title_store.list_titles()
+        print(self.history_titles)
         for item in self.history_titles:
             self.history_listbox.insert(tk.END, item['title'])
         
         self.history_scrollbar.config(command=self.history_listbox.yview)
         self.history_listbox.config(yscrollcommand=self._on_listbox_yscroll)
 
+    def _on_history_filter(self, event):
+        """输入停止 300ms 后再搜索，避免每次按键都查询"""
+        if hasattr(self, 'history_filter_job'):
+            self.history_root.after_cancel(self.history_filter_job)
+        self.history_filter_job = self.history_root.after(300, self._apply_history_filter)
+
+    def _apply_history_filter(self):
+        query = self.history_filter_var.get().strip()
+        if query:
+            self.history_titles = self.title_store.search(query, limit=50)
+        else:
+            self.history_titles = self.title_store.list_titles()
+        self.history_listbox.delete(0, tk.END)
+        for item in self.history_titles:
+            self.history_listbox.insert(tk.END, item['title'])
+
     def _on_listbox_yscroll(self, *args):
         """Listbox 调用 Scrollbar 时的回调"""
         self.history_scrollbar.set(*args)
@@ -298,24 +371,20 @@ class MainWindow:
 
     def _check_scroll_position(self):
         """检查是否滚动到顶部或底部"""
+        if not self.history_titles or self.history_filter_var.get().strip(): # 搜索结果不分页
+            return
         first, last = self.history_listbox.yview()
         print(first, last)
         if first <= 0.0:
-            with self.conn:
-                cursor = self.conn.cursor()
-                cursor.execute("SELECT id, title FROM titles WHERE id > ? ORDER BY id ASC LIMIT 20", (self.history_titles[0]['id'],))
-                new_titles = [{'id': row[0], 'title': row[1]} for row in cursor.fetchall()]
-                for item in new_titles:
-                    self.history_listbox.insert(0, item['title'])
-                    self.history_titles.insert(0, item)
+            new_titles = self.title_store.list_titles(above=self.history_titles[0]['id'])
+            for item in new_titles:
+                self.history_listbox.insert(0, item['title'])
+                self.history_titles.insert(0, item)
         elif last >= 1.0:
-            with self.conn:
-                cursor = self.conn.cursor()
-                cursor.execute("SELECT id, title FROM titles WHERE id < ? ORDER BY id DESC LIMIT 20", (self.history_titles[-1]['id'],))
-                new_titles = [{'id': row[0], 'title': row[1]} for row in cursor.fetchall()]
-                for item in new_titles:
-                    self.history_listbox.insert(tk.END, item['title'])
-                    self.history_titles.append(item)
+            new_titles = self.title_store.list_titles(below=self.history_titles[-1]['id'])
+            for item in new_titles:
+                self.history_listbox.insert(tk.END, item['title'])
+                self.history_titles.append(item)
     
     def _on_history_select(self, event):
         """列表项被选中时的回调函数"""
@@ -335,13 +404,13 @@ class MainWindow:
             self.history_listbox.delete(current_index)
             if hasattr(self, 'chatinstance'):
                 del self.chatinstance
+            self.renderer.discard()
             self.display_area.delete(1.0, tk.END)
-            path = f'saves/histories/{self.current_chat_index // 1000}/{self.current_chat_index % 1000}'
+            self.history_rendered_from = 0
+            path = history_path(self.current_chat_index)
             if os.path.exists(path):
                 os.remove(path)
-            with self.conn:
-                cursor = self.conn.cursor()
-                cursor.execute("DELETE FROM titles WHERE id = ?", (self.history_titles[current_index]['id'],))
+            self.title_store.delete_title(self.history_titles[current_index]['id'])
             del self.history_titles[current_index]
             self.current_chat_index = -1
 
@@ -355,21 +424,75 @@ class MainWindow:
         if hasattr(self, 'chatinstance'):
             self.archive_and_delete_chat()
         self.current_chat_index = self.history_titles[click_index]['id']
-        messages = self.history_cache.get(self.current_chat_index)
-        if not messages:
-            with open(f'saves/histories/{self.current_chat_index // 1000}/{self.current_chat_index % 1000}', 'r', encoding='utf-8') as f:
-                messages = json.load(f)
-            self.history_cache.put(self.current_chat_index, messages)
+        self.history_turns = []
+        self.history_rendered_from = 0
+        self.renderer.discard()
         self.display_area.delete(1.0, tk.END)
+        # 读取与解析放到后台线程，完成后回到 Tk 线程只渲染最近几轮
+        messages = self.history_cache.get(self.current_chat_index)
+        threading.Thread(target=self._load_history_worker, args=(self.current_chat_index, messages), daemon=True).start()
+
+    def _load_history_worker(self, chat_id: int, messages: list[dict] | None):
+        try:
+            if not messages:
+                messages = load_history(chat_id)
+            turns = self._history_turns(messages)
+        except Exception as e:
+            print(f"历史记录加载失败 {chat_id}: {e}")
+            self.root.after(0, self._show_history_error, chat_id, e)
+            return
+        self.root.after(0, self._show_history, chat_id, messages, turns)
+
+    def _show_history_error(self, chat_id: int, error: Exception):
+        if chat_id == self.current_chat_index:
+            self.display_area.insert("1.0", f"历史记录加载失败: {error}\n")
+
+    @staticmethod
+    def _history_turns(messages: list[dict]) -> list[list]:
+        """按轮次（以用户消息开头）整理出要显示的文本与标签，交替排列以便一次 insert"""
+        turns = []
         for message in messages:
             if message["role"] == "user":
                 text = message['content'][-1]['text']
                 text = text.rsplit("额外内容结束\n---\n", 1)[1] if "额外内容结束\n---\n" in text else text
-                self.insert_message(f"你: ", "user")
-                self.insert_message(text+"\n")
+                turns.append(["你: ", "user", text + "\n", ()])
             else:
-                self.insert_message(f"AI: ", "assistant")
-                self.insert_message(message['content']+"\n")
+                if not turns:
+                    turns.append([])
+                turns[-1] += ["AI: ", "assistant", message['content'] + "\n", ()]
+        return turns
+
+    def _show_history(self, chat_id: int, messages: list[dict], turns: list[list]):
+        if chat_id != self.current_chat_index: # 加载期间已切换到其他对话
+            return
+        if chat_id not in self.history_cache: # 加载期间可能已因发送消息而同步加载过
+            self.history_cache.put(chat_id, messages)
+        self.history_turns = turns
+        self.history_rendered_from = max(0, len(turns) - HISTORY_RENDER_TURNS)
+        args = [item for turn in turns[self.history_rendered_from:] for item in turn]
+        if args:
+            # 插入到开头：加载期间已发送的新一轮消息应排在历史之后
+            self.display_area.insert("1.0", *args)
+        self.display_area.see(tk.END)  # 滚动到最新消息
+
+    def _on_display_yscroll(self, first, last):
+        """显示区域滚动到顶部时再加载更早的轮次"""
+        self.display_area.vbar.set(first, last)
+        if float(first) <= 0.0 and self.history_rendered_from > 0 and not hasattr(self, 'history_more_job'):
+            self.history_more_job = self.root.after_idle(self._render_older_turns)
+
+    def _render_older_turns(self):
+        del self.history_more_job
+        if self.history_rendered_from <= 0:
+            return
+        start = max(0, self.history_rendered_from - HISTORY_RENDER_TURNS)
+        args = [item for turn in self.history_turns[start:self.history_rendered_from] for item in turn]
+        self.history_rendered_from = start
+        # 插入到开头后保持原来的首行仍在视图顶部
+        self.display_area.mark_set("history_top", "1.0")
+        self.display_area.mark_gravity("history_top", tk.RIGHT)
+        self.display_area.insert("1.0", *args)
+        self.display_area.yview("history_top")
     
     def toggle_show(self):
         if self.root.state() == 'normal':
@@ -379,31 +502,33 @@ class MainWindow:
     
     def new_chat(self, user_input = None):
         if user_input:
-            self.chatinstance = ChatInstance(self.main_model, mainwindow=self)
-            with self.conn:
-                cursor = self.conn.cursor()
-                cursor.execute("INSERT INTO titles (title) VALUES (?)", ("新对话",))
-                self.current_chat_index = cursor.lastrowid
+            self.chatinstance = ChatInstance(self.main_model, self.vision_model, mainwindow=self, assist_model=self.assist_model)
+            self.current_chat_index = self.title_store.insert_title("新对话").result()
             self.history_titles.insert(0, {'id': self.current_chat_index, 'title': "新对话"})
             if hasattr(self, 'history_listbox') and self.history_listbox.winfo_exists():
                 self.history_listbox.insert(0, self.history_titles[0]['title'])
-            threading.Thread(target=self._generate_and_insert_chat_title, args=(user_input,)).start()
+            chat_id = self.current_chat_index
+            title_service.submit(user_input, self.assist_model).add_done_callback(lambda future: self._insert_chat_title(chat_id, future))
         else:
-            self.chatinstance = ChatInstance(self.main_model, self.history_cache.get(self.current_chat_index), mainwindow=self)
+            messages = self.history_cache.get(self.current_chat_index)
+            if not messages: # 历史记录还在后台加载
+                messages = load_history(self.current_chat_index)
+                self.history_cache.put(self.current_chat_index, messages)
+            self.chatinstance = ChatInstance(self.main_model, self.vision_model, messages, mainwindow=self, assist_model=self.assist_model)
 
     def archive_and_delete_chat(self):
         if hasattr(self, "chatinstance"):
             messages = self.chatinstance.messages
             del self.chatinstance
-            folder = self.current_chat_index // 1000
-            if not os.path.exists(f'saves/histories/{folder}'):
-                os.makedirs(f'saves/histories/{folder}')
-            with open(f'saves/histories/{folder}/{self.current_chat_index % 1000}', 'w', encoding='utf-8') as f:
-                json.dump(messages, f, ensure_ascii=False)
+            save_history(self.current_chat_index, messages)
+            self.history_cache.put(self.current_chat_index, messages) # 对话过程中消息增加了，重新计算大小
+            self.title_store.index_chat(self.current_chat_index, messages)
 
     def on_newchat(self):
         self.archive_and_delete_chat()
+        self.renderer.discard()
         self.display_area.delete(1.0, tk.END)
+        self.history_rendered_from = 0
         self.current_chat_index = -1
     
     def open_add_multimedia(self):
@@ -545,13 +670,43 @@ class MainWindow:
         self.last_clipboard_data = current_clipboard_data
 
         if self.manual_extra_data:
-            self.chatinstance.messages[-1]["content"].extend([item["content"] for item in self.manual_extra_data])
+            # 仍在处理中的内容（如正在转写的视频）留到下一次发送
+            self.chatinstance.messages[-1]["content"].extend([item["content"] for item in self.manual_extra_data if not item.get("pending")])
+            self.manual_extra_data = [item for item in self.manual_extra_data if item.get("pending")]
             if hasattr(self, 'add_window'): # 处理手动添加的内容
-                self.add_listbox.delete(0, tk.END)
-            self.manual_extra_data = []
+                self.add_window.after(0, self._refresh_add_listbox)
         if self.chatinstance.messages[-1]["content"]:
             self.chatinstance.add({"type": "text", "text": "额外内容结束\n---"})
 
+    def _refresh_add_listbox(self):
+        """按 manual_extra_data 重建添加窗口的列表，需在添加窗口的线程中调用"""
+        self.add_listbox.delete(0, tk.END)
+        for item in self.manual_extra_data:
+            self.add_listbox.insert(tk.END, item["description"])
+
+    def _refresh_add_listbox_item(self, item: dict):
+        for index, i in enumerate(self.manual_extra_data):
+            if i is item:
+                self.add_listbox.delete(index)
+                self.add_listbox.insert(index, item["description"])
+                return
+
+    def add_extra_data(self, item: dict):
+        """添加一条手动内容，可从任意线程调用"""
+        self.manual_extra_data.append(item)
+        if hasattr(self, 'add_listbox'):
+            self.add_window.after(0, self.add_listbox.insert, tk.END, item["description"])
+
+    def update_extra_data(self, item: dict):
+        """更新处理中内容的描述或结果，可从任意线程调用；已被用户删除的内容忽略"""
+        if hasattr(self, 'add_listbox'):
+            self.add_window.after(0, self._refresh_add_listbox_item, item)
+
+    def remove_extra_data(self, item: dict):
+        self.manual_extra_data = [i for i in self.manual_extra_data if i is not item]
+        if hasattr(self, 'add_listbox'):
+            self.add_window.after(0, self._refresh_add_listbox)
+
     def _get_active_window_loop(self):
         while self.is_feature_screenshot_enable:
             active_window = gw.getActiveWindow()
@@ -569,7 +724,8 @@ class MainWindow:
         label.pack(pady=10)
         if hasattr(self, 'chatinstance'):
             self.archive_and_delete_chat()
-        self.conn.close()
+        self.title_store.close()
+        print(f"历史对话缓存: {self.history_cache.stats()}")
         if self.is_feature_web_server_enable:
             requests.get("http://127.0.0.1:3417/archive-all")
         with open("saves/settings.json", "w", encoding="utf-8") as f:
@@ -581,6 +737,8 @@ class MainWindow:
                 "main_model": self.main_model,
                 "assist_model": self.assist_model,
                 "vision_model": self.vision_model,
+                "web_server_mode": self.web_server_mode,
+                "history_cache_bytes": self.history_cache_bytes,
             }
             json.dump(settings, f, ensure_ascii=False)
         self.root.after(10, self.root.quit) # 退出 Tkinter
@@ -647,27 +805,40 @@ class WebServer:
             return 'OK', 200
     
     def _process_recieved_data(self, text, url, title):
+        pending_item = None
         domain_regex = r"^(?:https?:)?(?:\/\/)?([^\/\?:]+)(?:[\/\?:].*)?$"
         domain = re.search(domain_regex, url).group(1)
         try:
             match domain:
                 case "music.163.com":
-                    song_id = re.search(r"id=(\d+)", url).group(1)
-                    song_info = get_netease_music_details_text(song_id)
+                    if "playlist" in url: # 歌单页，批量获取其中的歌曲
+                        playlist_id = re.search(r"id=(\d+)", url).group(1)
+                        song_infos = get_netease_music_details_texts(get_netease_playlist_song_ids(playlist_id))
+                        song_info = "\n\n---\n\n".join(i for i in song_infos if i)
+                    else:
+                        song_id = re.search(r"id=(\d+)", url).group(1)
+                        song_info = get_netease_music_details_text(song_id)
                     self.mainwindow.manual_extra_data.append({"description": "网易云音乐: " + title, "content": {"type": "text", "text": f"```经过清洗的网易云音乐网页: {title}\n{song_info}\n```"}})
                     if hasattr(self.mainwindow, 'add_listbox'):
                         self.mainwindow.add_window.after(0, self.mainwindow.add_listbox.insert, tk.END, "网易云音乐: " + title)
                 case "b23.tv" | "bilibili.com" | "www.bilibili.com":
-                    video_data = get_bili_text(url)
+                    # 先放入一条处理中的占位，在添加窗口中显示下载/转写进度
+                    pending_item = {"description": "哔哩哔哩视频(处理中): " + title, "content": None, "pending": True}
+                    self.mainwindow.add_extra_data(pending_item)
+                    def report(progress):
+                        pending_item["description"] = f"哔哩哔哩视频({progress}): {title}"
+                        self.mainwindow.update_extra_data(pending_item)
+                    video_data = get_bili_text(url, progress=report)
                     video_info = f'''标题: {video_data["title"]}\n简介: {video_data["desc"]}\n标签: {video_data["tag"]}\n字幕: \n{video_data["text"]}'''
-                    self.mainwindow.manual_extra_data.append({"description": "哔哩哔哩视频: " + title, "content": {"type": "text", "text": f"```经过清洗的哔哩哔哩网页: {title}\n{video_info}\n```"}})
-                    if hasattr(self.mainwindow, 'add_listbox'):
-                        self.mainwindow.add_window.after(0, self.mainwindow.add_listbox.insert, tk.END, "哔哩哔哩视频: " + title)
+                    pending_item.update({"description": "哔哩哔哩视频: " + title, "content": {"type": "text", "text": f"```经过清洗的哔哩哔哩网页: {title}\n{video_info}\n```"}, "pending": False})
+                    self.mainwindow.update_extra_data(pending_item)
                 case _:
                     self.mainwindow.manual_extra_data.append({"description": "网页: " + title, "content": {"type": "text", "text": f"```网页: {title}\n{text}\n```"}})
                     if hasattr(self.mainwindow, 'add_listbox'):
                         self.mainwindow.add_window.after(0, self.mainwindow.add_listbox.insert, tk.END, "网页: " + title)
         except:
+            if pending_item is not None:
+                self.mainwindow.remove_extra_data(pending_item)
             self.mainwindow.manual_extra_data.append({"description": "网页: " + title, "content": {"type": "text", "text": f"```网页: {title}\n{text}\n```"}})
             if hasattr(self.mainwindow, 'add_listbox'):
                 self.mainwindow.add_listbox.insert(tk.END, "网页: " + title)
@@ -678,66 +849,6 @@ class WebServer:
         self.server_thread.daemon = True
         self.server_thread.start()
 
-class LRUCache:
-    def __init__(self, capacity=50, allow_reverse=False):
-        self.capacity = capacity
-        self.cache = OrderedDict()
-        self.allow_reverse = allow_reverse
-        # 只有开启反向查询时才初始化字典，节省空间
-        self.rev_cache = {} if allow_reverse else None
-    
-    def get(self, key):
-        if key not in self.cache:
-            return None
-        
-        # 移动到最新位置 (MRU)
-        self.cache.move_to_end(key)
-        val = self.cache[key]
-        
-        # 如果支持反向查询，既然这个key刚被访问过，它就是这个值对应的“最新”键
-        if self.allow_reverse:
-            self.rev_cache[val] = key
-            
-        return val
-    
-    def put(self, key, value):
-        if key in self.cache:
-            # key 已存在：移动到最新位置
-            self.cache.move_to_end(key)
-            
-            # 处理反向索引更新
-            if self.allow_reverse:
-                old_val = self.cache[key]
-                # 如果值发生了变化，且旧值的反向索引指向当前key，则删除旧索引
-                if old_val != value and self.rev_cache.get(old_val) == key:
-                    del self.rev_cache[old_val]
-        else:
-            # key 不存在：检查容量
-            if len(self.cache) >= self.capacity:
-                # 弹出最旧项 (FIFO)
-                old_k, old_v = self.cache.popitem(last=False)
-                
-                # 如果被删除的键是其值的反向索引代表，则清理反向索引
-                # 注意：如果 rev_cache[old_v] 指向的是别的（更新的）key，则不删除
-                if self.allow_reverse and self.rev_cache.get(old_v) == old_k:
-                    del self.rev_cache[old_v]
-        
-        # 更新主缓存
-        self.cache[key] = value
-        
-        # 更新反向索引：无论 value 是否重复，当前 key 都是该 value 的“最新”代表
-        if self.allow_reverse:
-            self.rev_cache[value] = key
-            
-    def find_key(self, value):
-        """
-        通过值反向查询键。
-        如果多个键对应同一个值，返回最新的（最后被 put 或 get 的）那个键。
-        """
-        if not self.allow_reverse:
-            return None
-        return self.rev_cache.get(value)
-
 if __name__ == "__main__":
     mainwindow = MainWindow()
     trayicon = TrayIcon()
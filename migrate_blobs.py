@@ -0,0 +1,62 @@
+"""把历史记录中内联的 base64 图片迁移到 saves/blobs
+
+用法:
+    python migrate_blobs.py         迁移所有历史文件
+    python migrate_blobs.py --gc    迁移后删除不再被任何历史引用的 blob
+
+请在程序退出后运行。
+"""
+import sys
+from individual_modules import *
+
+
+def migrate():
+    referenced = set()
+    migrated = 0
+    before_total = 0
+    after_total = 0
+    for folder in os.listdir('saves/histories'):
+        if not folder.isdigit():
+            continue
+        for name in os.listdir(f'saves/histories/{folder}'):
+            if not name.isdigit():
+                continue
+            chat_id = int(folder) * 1000 + int(name)
+            before = os.path.getsize(history_path(chat_id))
+            try:
+                messages = load_history(chat_id)
+            except Exception as e:
+                print(f"跳过 {chat_id}: {e}")
+                continue
+            dehydrated = dehydrate_messages(messages)
+            if any(a is not b for a, b in zip(dehydrated, messages)):
+                save_history(chat_id, dehydrated)
+                migrated += 1
+            after = os.path.getsize(history_path(chat_id))
+            before_total += before
+            after_total += after
+            for message in dehydrated:
+                if isinstance(message.get("content"), list):
+                    for item in message["content"]:
+                        if item.get("type") == "image_url" and item["image_url"]["url"].startswith(BLOB_URL_PREFIX):
+                            referenced.add(item["image_url"]["url"].removeprefix(BLOB_URL_PREFIX))
+    print(f"迁移了 {migrated} 个历史文件，历史文件总大小 {before_total / 1048576:.1f} MB -> {after_total / 1048576:.1f} MB")
+    return referenced
+
+
+def gc(referenced: set[str]):
+    if not os.path.exists(BLOB_DIR):
+        return
+    removed = 0
+    for folder in os.listdir(BLOB_DIR):
+        for name in os.listdir(f'{BLOB_DIR}/{folder}'):
+            if name not in referenced:
+                os.remove(f'{BLOB_DIR}/{folder}/{name}')
+                removed += 1
+    print(f"删除了 {removed} 个未被引用的 blob")
+
+
+if __name__ == "__main__":
+    referenced = migrate()
+    if "--gc" in sys.argv:
+        gc(referenced)
@@ -1,20 +1,19 @@
 from individual_modules import *
 
-def _run_server(main_model, vision_model, assist_model):
-    app = Flask(__name__)
+def _run_server(main_model, vision_model, assist_model, port=3417):
+    app = Flask(__name__, static_folder=None) # /static 由 _send_static 提供
     CORS(app)
     chatinstances: dict[int, ChatInstance] = {}
-    timeouts: dict[int, int] = {}
-    conn = sqlite3.connect('saves/history_titles.db', check_same_thread=False, timeout=5)
+    title_store = TitleStore()
+    conversation_cache = ConversationCache()
+    events = EventBroker() # 标题增删改推送给 /events 的订阅者
+    title_store.add_listener(events.publish)
+    log_timing = models.get("web-server", {}).get("log_timing", False) # 输出回答与标题的完成耗时
     model_config = {
         'main_model': main_model,
         'vision_model': vision_model,
         'assist_model': assist_model,
     }
-    with conn:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA busy_timeout = 5000")
-        cursor.execute("PRAGMA cache_size = -64000")
     
     @app.before_request
     def handle_options():
@@ -25,9 +24,28 @@ def _run_server(main_model, vision_model, assist_model):
             response.headers.add('Access-Control-Max-Age', '86400')  # 缓存24小时
             return response
 
+    def _send_static(name: str, cache_control: str):
+        resolved = resolve_static(name, request.headers.get('Accept-Encoding', ''))
+        if resolved is None:
+            return 'not found', 404
+        file_name, mimetype, encoding = resolved
+        response = make_response(send_from_directory(STATIC_DIR, file_name, mimetype=mimetype))
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = cache_control
+        return response
+
     @app.route('/')
     def index():
+        if static_built(): # 已运行 build_assets.py
+            return _send_static('index.html', 'no-cache')
         return send_from_directory('assets', 'index.html')
+
+    @app.route('/static/<name>')
+    def static_asset(name):
+        # 文件名带内容哈希，内容永不改变
+        return _send_static(name, 'public, max-age=31536000, immutable')
     
     @app.route('/script.js')
     def script():
@@ -41,57 +59,96 @@ def _run_server(main_model, vision_model, assist_model):
     def favicon():
         return send_from_directory('assets', 'favicon.ico')
     
+    @app.route('/blob/<name>')
+    def blob(name):
+        # 内容寻址，文件名即哈希，内容永不改变
+        try:
+            path = blob_path(name)
+        except ValueError:
+            return 'not found', 404
+        response = make_response(send_from_directory(os.path.dirname(path), os.path.basename(path)))
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    def _json_response(body: str, etag: str | None = None):
+        """超过阈值且客户端接受 gzip 时流式压缩；传入 etag 时支持条件请求返回 304"""
+        compress = should_gzip_json(body, request.headers.get('Accept-Encoding', ''))
+        if etag:
+            etag = f'"{etag}-gzip"' if compress else f'"{etag}"'
+        if etag and etag_matches(request.headers.get('If-None-Match'), etag):
+            response = Response(status=304)
+        elif compress:
+            response = Response(iter_gzip(body), mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(body, mimetype='application/json')
+        response.headers['Vary'] = 'Accept-Encoding'
+        if etag:
+            # 浏览器每次都要重新验证，内容未变时返回 304
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/search')
+    def search():
+        return _json_response(json.dumps(title_store.search(request.args.get('q', '')), ensure_ascii=False))
+
     @app.route('/get')
     def get():
         args = request.args
         if 'id' in args:
             id = int(args['id'])
+            if 'since' in args: # 增量获取：只返回第 since 条之后的消息和当前总数
+                since = max(int(args['since']), 0)
+                if id in chatinstances:
+                    messages = chatinstances[id].messages
+                    return _json_response(json.dumps({"length": len(messages), "messages": messages[since:]}, ensure_ascii=False))
+                if not os.path.exists(history_path(id)):
+                    return 'not found', 404
+                return _json_response(read_history_since(id, since))
             if id in chatinstances:
-                return jsonify(chatinstances[id].messages)
+                return _json_response(json.dumps(chatinstances[id].messages, ensure_ascii=False))
             else:
-                response = make_response(send_from_directory(f'saves/histories/{id // 1000}', str(id % 1000)))
-                response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-                response.headers['Pragma'] = 'no-cache'
-                return response
+                cached = conversation_cache.get(id)
+                if cached is None:
+                    return 'not found', 404
+                etag, body = cached
+                return _json_response(body, etag)
         elif 'below' in args:
-            id = int(args['below'])
-            with conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, title FROM titles WHERE id < ? ORDER BY id DESC LIMIT 20", (int(id),))
-                titles = [{'id': row[0], 'title': row[1]} for row in cursor.fetchall()]
-            return jsonify(titles)
+            return _json_response(json.dumps(title_store.list_titles(below=int(args['below'])), ensure_ascii=False))
         elif 'above' in args:
-            id = int(args['above'])
-            with conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, title FROM titles WHERE id > ? ORDER BY id ASC LIMIT 20", (int(id),))
-                titles = [{'id': row[0], 'title': row[1]} for row in cursor.fetchall()]
-            return jsonify(titles)
+            return _json_response(json.dumps(title_store.list_titles(above=int(args['above'])), ensure_ascii=False))
         else:
-            with conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, title FROM titles ORDER BY id DESC LIMIT 20")
-                titles = [{'id': row[0], 'title': row[1]} for row in cursor.fetchall()]
-            return jsonify(titles)
+            return _json_response(json.dumps(title_store.list_titles(), ensure_ascii=False))
     
-    def _generate_title_and_insert_and_return(queue: Queue, user_input: str, chat_id: int):
-        title = ask_ai(system="你是一个专业的标题生成器", user=user_input[-1]["text"] if len(user_input) < 40 else user_input[-1]["text"][:20] + "\n...\n" + user_input[-1]["text"][-20:], model=assist_model, prefix="```标题\n", stop="\n```")
-        with conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE titles SET title = ? WHERE id = ?", (title, chat_id))
+    def _insert_title(queue: Queue, chat_id: int, start: float, future: Future):
+        """title_service 完成后回调，独立于回答流：写入后由 /events 推送给所有客户端，回答流若尚未结束也顺带发送"""
+        try:
+            title = future.result()
+        except Exception as e:
+            print(f"标题生成失败 {chat_id}: {e}")
+            return
+        title_store.update_title(chat_id, title)
+        if log_timing:
+            print(f"[timing] {chat_id} 标题完成 {time.perf_counter() - start:.2f}s")
         queue.put({"title": title})
     
-    def _generate_and_insert(queue: Queue, user_inputs: str, chat_id: int, title_thread: threading.Thread = None):
+    def _generate_and_insert(queue: Queue, user_inputs: str, chat_id: int, start: float):
         if chat_id not in chatinstances:
-            chatinstances[chat_id] = ChatInstance(model=model_config["main_model"], vision_model=model_config["vision_model"])
+            chatinstances[chat_id] = ChatInstance(model=model_config["main_model"], vision_model=model_config["vision_model"], assist_model=model_config["assist_model"])
         chatinstance = chatinstances[chat_id]
         chatinstance.new()
         chatinstance.set(user_inputs)
-        for data in chatinstance():
-            queue.put(data)
-        if title_thread and title_thread.is_alive():
-            title_thread.join()
+        try:
+            for data in chatinstance():
+                queue.put(data)
+        except Exception as e:
+            print(f"回答生成失败 {chat_id}: {e}")
+            queue.put({"error": str(e)})
+        # 不等待标题，回答结束立即关闭流
         queue.put(None)
+        if log_timing:
+            print(f"[timing] {chat_id} 回答完成 {time.perf_counter() - start:.2f}s")
     
     def _generater(queue: Queue):
         is_first = True
@@ -105,47 +162,47 @@ def _run_server(main_model, vision_model, assist_model):
                 continue
             yield f"\n\ndata: {json.dumps(message, ensure_ascii=False)}"
     
-    def _timeout_checker(id):
-        timeouts[id] = time.time()
-        while True:
-            if time.time() - timeouts[id] > 15:
-                print(f"Timeout {id}")
-                if id not in chatinstances:
-                    return
-                folder = id // 1000
-                if not os.path.exists(f'saves/histories/{folder}'):
-                    os.makedirs(f'saves/histories/{folder}')
-                with open(f'saves/histories/{folder}/{id % 1000}', 'w', encoding='utf-8') as f:
-                    json.dump(chatinstances[id].messages, f, ensure_ascii=False)
-                del chatinstances[id]
-                del timeouts[id]
-                break
-            time.sleep(10)
+    def _archive_expired(ids: list[int]):
+        # 逐个处理：一个对话保存失败或已被 /save 移除，不影响同批的其他对话
+        for id in ids:
+            chatinstance = chatinstances.get(id)
+            if chatinstance is None:
+                continue
+            print(f"Timeout {id}")
+            try:
+                save_history(id, chatinstance.messages)
+                title_store.index_chat(id, chatinstance.messages)
+            except Exception as e:
+                print(f"归档 {id} 失败: {e}")
+                continue
+            chatinstances.pop(id, None)
+            conversation_cache.invalidate(id)
+
+    expiry = ExpiryScheduler(15, _archive_expired)
 
     @app.route('/generate', methods=['POST'])
     def generate():
+        start = time.perf_counter()
         request_body = request.get_json()
         message_queue = Queue()
         if "id" not in request_body:
-            with conn:
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO titles (title) VALUES (?)", ("新对话",))
-                id = cursor.lastrowid
+            id = title_store.insert_title("新对话").result()
             message_queue.put({"id": id})
-            title_thread = threading.Thread(target=_generate_title_and_insert_and_return, args=(message_queue, request_body["content"], id))
-            title_thread.start()
-            threading.Thread(target=_generate_and_insert, args=(message_queue, request_body["content"], id, title_thread)).start()
-            if id not in timeouts:
-                threading.Thread(target=_timeout_checker, args=(id,)).start()
+            text = title_input(request_body["content"])
+            if text: # 只有图片时保留“新对话”
+                try:
+                    title_service.submit(text, model_config["assist_model"]).add_done_callback(functools.partial(_insert_title, message_queue, id, start))
+                except Exception as e:
+                    print(f"标题生成失败 {id}: {e}")
+            threading.Thread(target=_generate_and_insert, args=(message_queue, request_body["content"], id, start)).start()
+            expiry.touch(id)
             return Response(_generater(message_queue), mimetype='text/event-stream')
         else:
             id = int(request_body["id"])
             if id not in chatinstances:
-                with open(f'saves/histories/{id // 1000}/{id % 1000}', 'r', encoding='utf-8') as f:
-                    chatinstances[id] = ChatInstance(model=model_config["main_model"], vision_model=model_config["vision_model"], messages=json.load(f))
-            threading.Thread(target=_generate_and_insert, args=(message_queue, request_body["content"], id)).start()
-            if id not in timeouts:
-                threading.Thread(target=_timeout_checker, args=(id,)).start()
+                chatinstances[id] = ChatInstance(model=model_config["main_model"], vision_model=model_config["vision_model"], assist_model=model_config["assist_model"], messages=load_history(id))
+            threading.Thread(target=_generate_and_insert, args=(message_queue, request_body["content"], id, start)).start()
+            expiry.touch(id)
             return Response(_generater(message_queue), mimetype='text/event-stream')
     
     @app.route('/save', methods=['GET', 'POST'])
@@ -154,12 +211,11 @@ def _run_server(main_model, vision_model, assist_model):
         id = int(args['id'])
         if id not in chatinstances:
             return 'ok'
-        folder = id // 1000
-        if not os.path.exists(f'saves/histories/{folder}'):
-            os.makedirs(f'saves/histories/{folder}')
-        with open(f'saves/histories/{folder}/{id % 1000}', 'w', encoding='utf-8') as f:
-            json.dump(chatinstances[id].messages, f, ensure_ascii=False)
+        save_history(id, chatinstances[id].messages)
+        title_store.index_chat(id, chatinstances[id].messages)
         del chatinstances[id]
+        conversation_cache.invalidate(id)
+        expiry.discard(id)
         return 'ok'
     
     @app.route('/configure', methods=['POST'])
@@ -178,19 +234,49 @@ def _run_server(main_model, vision_model, assist_model):
     def alive():
         args = request.args
         id = int(args['id'])
-        if id not in timeouts:
+        if id not in expiry:
             return 'ok'
-        timeouts[id] = time.time()
+        expiry.touch(id)
         return 'ok'
 
+    @app.route('/events', methods=['GET', 'POST'])
+    def title_events():
+        if request.method == 'POST': # 托盘进程转发它自己写入的标题变化，只接受本机请求
+            if not is_loopback(request.remote_addr):
+                return 'forbidden', 403
+            event = validate_title_event(request.get_json(silent=True))
+            if event is None:
+                return 'invalid event', 400
+            events.publish(event)
+            return 'ok'
+        queue = Queue(256)
+        events.subscribe(queue.put_nowait)
+        def stream():
+            try:
+                yield "retry: 3000\n\n"
+                while True:
+                    try:
+                        event = queue.get(timeout=15)
+                    except Empty:
+                        yield ": ping\n\n" # 心跳，及时发现已断开的连接
+                        continue
+                    yield format_sse_event("title", event)
+            finally:
+                events.unsubscribe(queue.put_nowait)
+        response = Response(stream(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/sessions')
+    def sessions():
+        return jsonify({'live': len(expiry), 'loaded': len(chatinstances)})
+
     @app.route('/archive-all')
     def archive_all():
         for i in chatinstances:
-            folder = i // 1000
-            if not os.path.exists(f'saves/histories/{folder}'):
-                os.makedirs(f'saves/histories/{folder}')
-            with open(f'saves/histories/{folder}/{i % 1000}', 'w', encoding='utf-8') as f:
-                json.dump(chatinstances[i].messages, f, ensure_ascii=False)
+            save_history(i, chatinstances[i].messages)
+            title_store.index_chat(i, chatinstances[i].messages)
+            conversation_cache.invalidate(i)
         return 'ok'
 
-    app.run(debug=False, host='0.0.0.0', port=3417)
\ No newline at end of file
+    app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,315 @@
+from individual_modules import *
+from quart import Quart, request, jsonify, send_from_directory, Response, make_response
+from quart_cors import cors
+from hypercorn.asyncio import serve
+from hypercorn.config import Config as HypercornConfig
+
+def _run_async_server(main_model, vision_model, assist_model, port=3417):
+    """与 server._run_server 路由相同的 asyncio 版本，单进程单线程处理所有流"""
+    app = cors(Quart(__name__, static_folder=None)) # /static 由 _send_static 提供
+    # 流式响应可能持续数分钟，关闭 Quart 默认 60 秒的响应超时
+    app.config['RESPONSE_TIMEOUT'] = None
+    chatinstances: dict[int, ChatInstance] = {}
+    title_store = TitleStore()
+    conversation_cache = ConversationCache()
+    events = EventBroker() # 标题增删改推送给 /events 的订阅者
+    title_store.add_listener(events.publish)
+    log_timing = models.get("web-server", {}).get("log_timing", False) # 输出回答与标题的完成耗时
+    model_config = {
+        'main_model': main_model,
+        'vision_model': vision_model,
+        'assist_model': assist_model,
+    }
+    @app.before_request
+    async def handle_options():
+        if request.method == 'OPTIONS':
+            response = jsonify()
+            response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
+            response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
+            response.headers.add('Access-Control-Max-Age', '86400')  # 缓存24小时
+            return response
+
+    async def _send_static(name: str, cache_control: str):
+        resolved = resolve_static(name, request.headers.get('Accept-Encoding', ''))
+        if resolved is None:
+            return 'not found', 404
+        file_name, mimetype, encoding = resolved
+        response = await make_response(await send_from_directory(STATIC_DIR, file_name, mimetype=mimetype))
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    @app.route('/')
+    async def index():
+        if static_built(): # 已运行 build_assets.py
+            return await _send_static('index.html', 'no-cache')
+        return await send_from_directory('assets', 'index.html')
+
+    @app.route('/static/<name>')
+    async def static_asset(name):
+        # 文件名带内容哈希，内容永不改变
+        return await _send_static(name, 'public, max-age=31536000, immutable')
+
+    @app.route('/script.js')
+    async def script():
+        return await send_from_directory('assets', 'script.js')
+
+    @app.route('/style.css')
+    async def style():
+        return await send_from_directory('assets', 'style.css')
+
+    @app.route('/favicon.ico')
+    async def favicon():
+        return await send_from_directory('assets', 'favicon.ico')
+
+    @app.route('/blob/<name>')
+    async def blob(name):
+        try:
+            path = blob_path(name)
+        except ValueError:
+            return 'not found', 404
+        response = await make_response(await send_from_directory(os.path.dirname(path), os.path.basename(path)))
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    async def _gzip_stream(body: str):
+        # 压缩在线程中进行，不阻塞事件循环
+        chunks = iter_gzip(body)
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+
+    def _json_response(body: str, etag: str | None = None):
+        """超过阈值且客户端接受 gzip 时流式压缩；传入 etag 时支持条件请求返回 304"""
+        compress = should_gzip_json(body, request.headers.get('Accept-Encoding', ''))
+        if etag:
+            etag = f'"{etag}-gzip"' if compress else f'"{etag}"'
+        if etag and etag_matches(request.headers.get('If-None-Match'), etag):
+            response = Response(status=304)
+        elif compress:
+            response = Response(_gzip_stream(body), mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(body, mimetype='application/json')
+        response.headers['Vary'] = 'Accept-Encoding'
+        if etag:
+            # 浏览器每次都要重新验证，内容未变时返回 304
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/search')
+    async def search():
+        return _json_response(json.dumps(await asyncio.to_thread(title_store.search, request.args.get('q', '')), ensure_ascii=False))
+
+    @app.route('/get')
+    async def get():
+        args = request.args
+        if 'id' in args:
+            id = int(args['id'])
+            if 'since' in args: # 增量获取：只返回第 since 条之后的消息和当前总数
+                since = max(int(args['since']), 0)
+                if id in chatinstances:
+                    messages = chatinstances[id].messages
+                    return _json_response(json.dumps({"length": len(messages), "messages": messages[since:]}, ensure_ascii=False))
+                if not os.path.exists(history_path(id)):
+                    return 'not found', 404
+                return _json_response(await asyncio.to_thread(read_history_since, id, since))
+            if id in chatinstances:
+                return _json_response(await asyncio.to_thread(json.dumps, chatinstances[id].messages, ensure_ascii=False))
+            else:
+                cached = await asyncio.to_thread(conversation_cache.get, id)
+                if cached is None:
+                    return 'not found', 404
+                etag, body = cached
+                return _json_response(body, etag)
+        elif 'below' in args:
+            return _json_response(json.dumps(await asyncio.to_thread(title_store.list_titles, below=int(args['below'])), ensure_ascii=False))
+        elif 'above' in args:
+            return _json_response(json.dumps(await asyncio.to_thread(title_store.list_titles, above=int(args['above'])), ensure_ascii=False))
+        else:
+            return _json_response(json.dumps(await asyncio.to_thread(title_store.list_titles), ensure_ascii=False))
+
+    title_tasks: set[asyncio.Task] = set() # 保持对后台标题任务的引用，回答流结束后它们仍继续运行
+
+    async def _generate_title_and_insert(user_input: list[dict], chat_id: int, start: float):
+        """独立于回答流生成标题：写入后由 /events 推送给所有客户端"""
+        text = title_input(user_input)
+        if not text: # 只有图片时保留“新对话”
+            return None
+        try:
+            # shield：取消本任务时不取消 title_service 中可能被其他对话共享的 Future
+            # submit 会查询磁盘缓存（SQLite），放到线程中执行
+            future = await asyncio.to_thread(title_service.submit, text, model_config["assist_model"])
+            title = await asyncio.shield(asyncio.wrap_future(future))
+            await asyncio.wrap_future(title_store.update_title(chat_id, title))
+        except Exception as e:
+            print(f"标题生成失败 {chat_id}: {e}")
+            return None
+        if log_timing:
+            print(f"[timing] {chat_id} 标题完成 {time.perf_counter() - start:.2f}s")
+        return title
+
+    def _format(message: dict, is_first: bool) -> str:
+        # 与 server._generater 的输出格式保持一致
+        if is_first:
+            return f"data: {json.dumps(message, ensure_ascii=False)}"
+        return f"\n\ndata: {json.dumps(message, ensure_ascii=False)}"
+
+    async def _generater(chatinstance: ChatInstance, chat_id: int, start: float, title_task: asyncio.Task | None = None):
+        is_first = True
+        if title_task:
+            yield _format({"id": chat_id}, is_first)
+            is_first = False
+        try:
+            async for data in chatinstance.stream_async():
+                yield _format(data, is_first)
+                is_first = False
+        except Exception as e:
+            print(f"回答生成失败 {chat_id}: {e}")
+            if title_task:
+                title_task.cancel() # 回答失败，不再为这个对话生成标题
+            # 告诉网页端回答不完整，而不是当作正常结束
+            yield _format({"error": str(e)}, is_first)
+            return
+        # 不等待标题，回答结束立即关闭流；标题已经生成好时顺带发送
+        if title_task and title_task.done() and not title_task.cancelled() and title_task.result():
+            yield _format({"title": title_task.result()}, is_first)
+        if log_timing:
+            print(f"[timing] {chat_id} 回答完成 {time.perf_counter() - start:.2f}s")
+
+    async def _archive_expired(ids: list[int]):
+        # 逐个处理：一个对话保存失败或已被 /save 移除，不影响同批的其他对话
+        for id in ids:
+            chatinstance = chatinstances.get(id)
+            if chatinstance is None:
+                continue
+            print(f"Timeout {id}")
+            try:
+                await asyncio.to_thread(save_history, id, chatinstance.messages)
+                title_store.index_chat(id, chatinstance.messages)
+            except Exception as e:
+                print(f"归档 {id} 失败: {e}")
+                continue
+            chatinstances.pop(id, None)
+            conversation_cache.invalidate(id)
+
+    def _log_archive_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"归档失败: {future.exception()}")
+
+    expiry: ExpiryScheduler = None
+
+    @app.before_serving
+    async def start_expiry():
+        nonlocal expiry
+        loop = asyncio.get_running_loop()
+        # 调度线程只负责计时，归档回到事件循环中执行
+        expiry = ExpiryScheduler(15, lambda ids: asyncio.run_coroutine_threadsafe(_archive_expired(ids), loop).add_done_callback(_log_archive_error))
+
+    @app.route('/generate', methods=['POST'])
+    async def generate():
+        start = time.perf_counter()
+        request_body = await request.get_json()
+        title_task = None
+        if "id" not in request_body:
+            id = await asyncio.wrap_future(title_store.insert_title("新对话"))
+            title_task = asyncio.create_task(_generate_title_and_insert(request_body["content"], id, start))
+            title_tasks.add(title_task)
+            title_task.add_done_callback(title_tasks.discard)
+        else:
+            id = int(request_body["id"])
+        if id not in chatinstances:
+            messages = await asyncio.to_thread(load_history, id) if title_task is None else None
+            chatinstances[id] = ChatInstance(model=model_config["main_model"], vision_model=model_config["vision_model"], assist_model=model_config["assist_model"], messages=messages)
+        chatinstance = chatinstances[id]
+        chatinstance.new()
+        chatinstance.set(request_body["content"])
+        expiry.touch(id)
+        return Response(_generater(chatinstance, id, start, title_task), mimetype='text/event-stream')
+
+    @app.route('/save', methods=['GET', 'POST'])
+    async def save():
+        id = int(request.args['id'])
+        if id not in chatinstances:
+            return 'ok'
+        await asyncio.to_thread(save_history, id, chatinstances[id].messages)
+        title_store.index_chat(id, chatinstances[id].messages)
+        del chatinstances[id]
+        conversation_cache.invalidate(id)
+        expiry.discard(id)
+        return 'ok'
+
+    @app.route('/configure', methods=['POST'])
+    async def configure():
+        request_body = await request.get_json()
+        print(request_body)
+        if "main_model" in request_body:
+            model_config["main_model"] = request_body["main_model"]
+        if "vision_model" in request_body:
+            model_config["vision_model"] = request_body["vision_model"]
+        if "assist_model" in request_body:
+            model_config["assist_model"] = request_body["assist_model"]
+        return 'ok'
+
+    @app.route('/alive')
+    async def alive():
+        id = int(request.args['id'])
+        if id not in expiry:
+            return 'ok'
+        expiry.touch(id)
+        return 'ok'
+
+    @app.route('/events', methods=['GET', 'POST'])
+    async def title_events():
+        if request.method == 'POST': # 托盘进程转发它自己写入的标题变化，只接受本机请求
+            if not is_loopback(request.remote_addr):
+                return 'forbidden', 403
+            event = validate_title_event(await request.get_json(silent=True))
+            if event is None:
+                return 'invalid event', 400
+            events.publish(event)
+            return 'ok'
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(256)
+        def deliver(event: dict):
+            # 标题事件来自写线程，投递回事件循环；队列已满时丢弃
+            loop.call_soon_threadsafe(lambda: queue.full() or queue.put_nowait(event))
+        events.subscribe(deliver)
+        async def stream():
+            try:
+                yield "retry: 3000\n\n"
+                while True:
+                    try:
+                        event = await asyncio.wait_for(queue.get(), 15)
+                    except asyncio.TimeoutError:
+                        yield ": ping\n\n" # 心跳，及时发现已断开的连接
+                        continue
+                    yield format_sse_event("title", event)
+            finally:
+                events.unsubscribe(deliver)
+        response = Response(stream(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    @app.route('/sessions')
+    async def sessions():
+        return jsonify({'live': len(expiry), 'loaded': len(chatinstances)})
+
+    @app.route('/archive-all')
+    async def archive_all():
+        for i in list(chatinstances):
+            # await 期间对话可能已被超时归档或 /save 移除
+            chatinstance = chatinstances.get(i)
+            if chatinstance is None:
+                continue
+            await asyncio.to_thread(save_history, i, chatinstance.messages)
+            title_store.index_chat(i, chatinstance.messages)
+            conversation_cache.invalidate(i)
+        return 'ok'
+
+    config = HypercornConfig()
+    config.bind = [f'0.0.0.0:{port}']
+    config.keep_alive_timeout = 75
+    asyncio.run(serve(app, config))